@@ -2,20 +2,9 @@
 # Purpose: The core comparison logic that runs on each LSF node.
 import argparse, os, sys, mmap, csv, re, multiprocessing, time
 
-NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
-METADATA_KEYWORDS_SET = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
+from report_common import is_valid_instance_line
 
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#"): return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword): return False
-    return True
+NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
 
 def extract_value(value_bytes, comparison_type):
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
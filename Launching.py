@@ -1,33 +1,99 @@
 # File: launch_comparison.py
 # Purpose: A more robust version with simplified and corrected LSF syntax.
 import os
+import shlex
 import subprocess
 import time
+import multiprocessing
+import zlib
+from collections import deque
 
-# --- (Sharding functions are unchanged) ---
-def get_instance_key(line, key_cols):
-    parts = line.strip().split()
-    if len(parts) <= max(key_cols): return None
-    return "_".join(parts[i] for i in key_cols)
+from report_common import has_plain_keys, key_field
 
-def shard_file(input_file, key_cols, num_shards, output_dir):
-    print(f"-> Processing {input_file}...")
+SHARD_RANGE_SIZE = 64 * 1024 * 1024  # Bytes of input handed to each sharding worker
+SHARD_RANGES_IN_FLIGHT_PER_WORKER = 2  # Sharded ranges queued or held per worker before the writer catches up
+# LSF application profile carrying the compare jobs' slot count and RES_REQ=rusage[mem=16G]
+# (e.g. "py_compare"). Leave as None to pass -n/-R on the command line instead.
+LSF_APP_PROFILE = None
+
+# --- Sharding functions ---
+def bucket_lines(lines, key_cols, num_shards, plain_keys=False):
+    """Distributes a batch of raw lines into one list per shard, skipping blanks and comments.
+
+    plain_keys says every token is already its own key_field() (see has_plain_keys), so the
+    shard key can be hashed without normalising its fields.
+    """
+    buckets = [[] for _ in range(num_shards)]
+    max_col = max(key_cols)
+    for line in lines:
+        # Only split as far as the last key column; the rest of the line is never looked at.
+        parts = line.split(None, max_col + 1)
+        if len(parts) <= max_col or parts[0].startswith(b"#"): continue
+        # crc32 of the normalised key compare_adv.py matches on, so lines it matches share a
+        # shard; it runs in C and, unlike hash(), is the same in every process and run.
+        if plain_keys: key = b"\x00".join(parts[i] for i in key_cols)
+        else: key = b"\x00".join(key_field(parts[i]) for i in key_cols)
+        buckets[zlib.crc32(key) % num_shards].append(line)
+    return buckets
+
+def shard_byte_range(args_tuple):
+    """Worker: shards every line that starts inside [start, end) and returns (line_count, one blob per shard)."""
+    input_file, start, end, key_cols, num_shards = args_tuple
+    with open(input_file, "rb") as f:
+        if start > 0:
+            # Skip the line straddling `start`; the previous range owns it.
+            f.seek(start - 1)
+            f.readline()
+        begin = f.tell()
+        if begin >= end: return 0, [b""] * num_shards
+        data = f.read(end - begin)
+        if not data.endswith(b"\n"): data += f.readline()
+    lines = data.split(b"\n")
+    if not lines[-1]: lines.pop()
+    buckets = bucket_lines(lines, key_cols, num_shards, has_plain_keys(data))
+    return len(lines), [b"\n".join(bucket) + b"\n" if bucket else b"" for bucket in buckets]
+
+def imap_bounded(pool, func, tasks, max_in_flight):
+    """Like pool.imap, but with at most max_in_flight tasks submitted and not yet consumed."""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def shard_files(inputs, num_shards, output_dir):
+    """Shards several (input_file, key_cols) inputs through one worker pool, one input at a time.
+
+    Only the current input's shard files are open, and the workers run at most
+    SHARD_RANGES_IN_FLIGHT_PER_WORKER ranges ahead of the writer, so sharded blobs
+    never pile up in memory.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    output_files = [open(os.path.join(output_dir, f"{os.path.basename(input_file)}_shard_{i}.txt"), "w") for i in range(num_shards)]
-    with open(input_file, "r", errors='ignore') as f:
-        line_count = 0
-        for line in f:
-            line_count += 1
-            if line_count % 5000000 == 0:
-                print(f"   ...processed {line_count // 1000000}M lines")
-            if not line.strip() or line.strip().startswith("#"): continue
-            key = get_instance_key(line, key_cols)
-            if key is None: continue
-            shard_index = hash(key) % num_shards
-            output_files[shard_index].write(line)
-    for file_handle in output_files: file_handle.close()
-    print(f"-> Finished sharding {input_file}.")
+    workers = os.cpu_count()
+    with multiprocessing.Pool(workers) as pool:
+        for input_file, key_cols in inputs:
+            print(f"-> Processing {input_file}...")
+            size = os.path.getsize(input_file)
+            tasks = ((input_file, start, min(start + SHARD_RANGE_SIZE, size), key_cols, num_shards)
+                     for start in range(0, size, SHARD_RANGE_SIZE))
+            # Each write is one range's whole blob for a shard, so the files need no buffer of their own.
+            output_files = [open(os.path.join(output_dir, f"{os.path.basename(input_file)}_shard_{i}.txt"), "wb", buffering=0) for i in range(num_shards)]
+            try:
+                line_count, next_report = 0, 5000000
+                # Results come back in range order so only this process writes the shard files, in file order.
+                for range_lines, blobs in imap_bounded(pool, shard_byte_range, tasks, workers * SHARD_RANGES_IN_FLIGHT_PER_WORKER):
+                    line_count += range_lines
+                    if line_count >= next_report:
+                        print(f"   ...processed {line_count // 1000000}M lines")
+                        next_report += 5000000
+                    for file_handle, blob in zip(output_files, blobs):
+                        if blob: file_handle.write(blob)
+            finally:
+                for file_handle in output_files: file_handle.close()
+            print(f"-> Finished sharding {input_file}.")
 
 def main():
     """Guides the user, shards files, and submits LSF jobs with corrected syntax."""
@@ -51,8 +117,8 @@ def main():
 
     # --- Part 2: Sharding Files ---
     print("\n--- Part 2: Sharding Files ---")
-    shard_file(file1, list(map(int, instcol1_str.split(','))), shards, "shards")
-    shard_file(file2, list(map(int, instcol2_str.split(','))), shards, "shards")
+    shard_files([(file1, list(map(int, instcol1_str.split(',')))),
+                 (file2, list(map(int, instcol2_str.split(','))))], shards, "shards")
     print("✅ Sharding complete.")
 
     # --- Part 3: Submitting Job Array and Dependent Merge Job ---
@@ -65,40 +131,48 @@ def main():
     job_array_name = "py_compare_array"
     print(f"-> Assigning job array name: {job_array_name}")
 
-    # --- MODIFICATION: Removed quotes around the -J argument ---
-    compare_command = (
-        f"bsub -n 2 -R 'rusage[mem=16G]' -o 'logs/output_%I.log' -J {job_array_name}[0-{shards-1}] "
-        f"\"{python_command} compare_adv.py "
-        f"--file1 'shards/{os.path.basename(file1)}_shard_%I.txt' "
-        f"--file2 'shards/{os.path.basename(file2)}_shard_%I.txt' "
-        f"--instcol1 '{instcol1_str}' --valcol1 {valcol1} "
-        f"--instcol2 '{instcol2_str}' --valcol2 {valcol2} "
-        f"--output_prefix 'results/run_%I' "
-        f"--comparison_type {comparison_type}\""
-    )
-
-    merge_command = (
-        f"bsub -w 'done({job_array_name})' -o 'logs/merge_output.log' -J merge_{job_array_name} "
-        f"\"{python_command} merge_results.py --shards {shards} --start_time {start_time}\""
-    )
+    # --- MODIFICATION: Commands are argv lists run without a shell, so nothing needs quoting ---
+    if LSF_APP_PROFILE:
+        resource_args = ["-app", LSF_APP_PROFILE]
+    else:
+        resource_args = ["-n", "2", "-R", "rusage[mem=16G]"]
+    compare_command = [
+        "bsub", *resource_args, "-o", "logs/output_%I.log", "-J", f"{job_array_name}[0-{shards-1}]",
+        python_command, "compare_adv.py",
+        "--file1", f"shards/{os.path.basename(file1)}_shard_%I.txt",
+        "--file2", f"shards/{os.path.basename(file2)}_shard_%I.txt",
+        "--instcol1", instcol1_str, "--valcol1", valcol1,
+        "--instcol2", instcol2_str, "--valcol2", valcol2,
+        "--output_prefix", "results/run_%I", "--lf_rows",
+        "--comparison_type", comparison_type,
+    ]
+
+    merge_command = [
+        "bsub", "-w", f"done({job_array_name})", "-o", "logs/merge_output.log", "-J", f"merge_{job_array_name}",
+        python_command, "merge_results.py", "--shards", str(shards), "--start_time", str(start_time),
+    ]
 
     try:
         print("\n--- The following commands will be executed ---")
-        print(f"COMPARE JOB COMMAND:\n{compare_command}\n")
-        print(f"MERGE JOB COMMAND:\n{merge_command}\n")
+        print(f"COMPARE JOB COMMAND:\n{shlex.join(compare_command)}\n")
+        print(f"MERGE JOB COMMAND:\n{shlex.join(merge_command)}\n")
         
         input("Press Enter to continue and submit these jobs to LSF, or Ctrl+C to cancel...")
 
         print("\n-> Submitting comparison job array...")
-        subprocess.run(compare_command, shell=True, check=True)
+        subprocess.run(compare_command, check=True)
         
         print("-> Submitting dependent merge job...")
-        subprocess.run(merge_command, shell=True, check=True)
+        subprocess.run(merge_command, check=True)
         
     except subprocess.CalledProcessError as e:
         print("\n  ERROR: LSF submission failed. The `bsub` command returned an error.")
         print("  Please check the command printed above for syntax errors.")
         return
+    except FileNotFoundError:
+        print("\n  ERROR: LSF submission failed. The `bsub` command was not found.")
+        print("  Are you running on a machine with LSF installed and `bsub` on your PATH?")
+        return
     except KeyboardInterrupt:
         print("\n\nSubmission cancelled by user.")
         return
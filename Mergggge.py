@@ -2,34 +2,50 @@
 # Purpose: Merges all partial results into final output files and reports total runtime.
 import os
 import argparse
+import shutil
 import time
 
+COPY_BUFFER_SIZE = 16 * 1024 * 1024  # Chunk size for the copyfileobj fallback
+
+def append_file(final_out, partial_file, skip_header=False):
+    """Appends partial_file to the unbuffered final_out, optionally without its first line.
+
+    os.sendfile moves the bytes inside the kernel, so no partial file is ever read into Python.
+    """
+    with open(partial_file, "rb") as f_in:
+        offset = len(f_in.readline()) if skip_header else 0
+        if hasattr(os, "sendfile"):
+            size = os.fstat(f_in.fileno()).st_size
+            while offset < size:
+                sent = os.sendfile(final_out.fileno(), f_in.fileno(), offset, size - offset)
+                if sent == 0: break
+                offset += sent
+        else:
+            f_in.seek(offset)
+            shutil.copyfileobj(f_in, final_out, COPY_BUFFER_SIZE)
+
 def merge_csv_files(num_shards, prefix, final_filename):
     print(f"-> Merging {num_shards} comparison CSV files...")
     first_file = f"{prefix}_0_comparison.csv"
     if not os.path.exists(first_file):
         print(f"  ERROR: Cannot find the first result file: {first_file}")
         return False
-    with open(final_filename, "w") as final_out:
-        with open(first_file, "r") as f_in:
-            final_out.write(f_in.read())
+    with open(final_filename, "wb", buffering=0) as final_out:
+        append_file(final_out, first_file)
         for i in range(1, num_shards):
             partial_file = f"{prefix}_{i}_comparison.csv"
             if os.path.exists(partial_file):
-                with open(partial_file, "r") as f_in:
-                    next(f_in)
-                    final_out.write(f_in.read())
+                append_file(final_out, partial_file, skip_header=True)
     return True
 
 def merge_txt_files(num_shards, prefix, final_filename):
     print(f"-> Merging {num_shards} missing instance TXT files...")
-    with open(final_filename, "w") as final_out:
+    with open(final_filename, "wb", buffering=0) as final_out:
         for i in range(num_shards):
             partial_file = f"{prefix}_{i}_missing_instances.txt"
             if os.path.exists(partial_file):
-                with open(partial_file, "r") as f_in:
-                    final_out.write(f_in.read())
-                    final_out.write("\n")
+                append_file(final_out, partial_file)
+                final_out.write(b"\n")
     return True
 
 def main():
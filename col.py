@@ -7,22 +7,7 @@ import csv
 import multiprocessing
 import re
 
-METADATA_KEYWORDS = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-METADATA_KEYWORDS_SET = set(METADATA_KEYWORDS)
-
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#"):
-        return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword):
-            return False
-    return True
+from report_common import is_valid_instance_line
 
 def extract_value(value_bytes):
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
@@ -6,59 +6,68 @@ import sys
 import mmap
 from multiprocessing import Pool
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
+from report_common import advise_sequential, is_metadata
+
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
 
 def is_valid_instance_line(line):
     line = line.strip()
-    if not line or line.startswith(b"#"):
-        return False
-    if any(line.startswith(keyword.encode()) for keyword in METADATA_KEYWORDS):
+    if not line or line.startswith(b"#") or is_metadata(line):
         return False
     return line.startswith(b"-")
 
 def parse_file_with_mmap(args):
     file_path, column_index, starts_with = args
     instances = []
+    line_count = 0  # Counted here so the statistic needs no second pass over the file
     collecting = False
     streak = 0
+    # Stop splitting after the last needed column; the rest of the line is never looked at
+    maxsplit = column_index + 1
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        for line in iter(mmapped_file.readline, b""):
-            if not collecting:
-                if is_valid_instance_line(line):
-                    streak += 1
-                    if streak >= 25:
-                        collecting = True
-                        parts = line.strip().split()
-                        if len(parts) > column_index:
-                            value = parts[column_index]
-                            if starts_with and value.startswith(starts_with.encode()):
-                                value = value[len(starts_with):]
-                                if not value:
-                                    continue
-                            instances.append(value.decode(errors='ignore'))
-                else:
-                    streak = 0
-                continue
-            if not is_valid_instance_line(line):
-                continue
-            parts = line.strip().split()
-            if len(parts) <= column_index:
-                continue
-            value = parts[column_index]
-            if starts_with and value.startswith(starts_with.encode()):
-                value = value[len(starts_with):]
-                if not value:
+        advise_sequential(mmapped_file)
+        size = mmapped_file.size()
+        offset, tail = 0, b""
+        while offset < size:
+            # Split one large chunk into lines at a time instead of a readline() call per line
+            lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            line_count += len(lines) - 1
+            # Carry the partial last line into the next chunk (keep it on the final one)
+            tail = lines.pop() if offset < size else b""
+            for line in lines:
+                if not collecting:
+                    if is_valid_instance_line(line):
+                        streak += 1
+                        if streak >= 25:
+                            collecting = True
+                            parts = line.split(None, maxsplit)
+                            if len(parts) > column_index:
+                                value = parts[column_index]
+                                if starts_with and value.startswith(starts_with.encode()):
+                                    value = value[len(starts_with):]
+                                    if not value:
+                                        continue
+                                instances.append(value.decode(errors='ignore'))
+                    else:
+                        streak = 0
+                    continue
+                if not is_valid_instance_line(line):
                     continue
-            instances.append(value.decode(errors='ignore'))
+                parts = line.split(None, maxsplit)
+                if len(parts) <= column_index:
+                    continue
+                value = parts[column_index]
+                if starts_with and value.startswith(starts_with.encode()):
+                    value = value[len(starts_with):]
+                    if not value:
+                        continue
+                instances.append(value.decode(errors='ignore'))
+        if lines[-1]:
+            line_count += 1  # Last line has no trailing newline
         mmapped_file.close()
-    return instances
+    return instances, line_count
 
 def compare_instances(instances1, instances2):
     set1 = set(instances1)
@@ -67,10 +76,6 @@ def compare_instances(instances1, instances2):
     missing_in_file1 = [i for i in instances2 if i not in set1]
     return missing_in_file2, missing_in_file1
 
-def count_lines(path):
-    with open(path, 'rb') as f:
-        return sum(1 for _ in f)
-
 def get_column_name(file_path, col_index):
     with open(file_path, 'r') as f:
         for line in f:
@@ -124,15 +129,12 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    lines1 = count_lines(args.file1)
-    lines2 = count_lines(args.file2)
-
     with Pool(processes=2) as pool:
         results = pool.map(parse_file_with_mmap, [
             (args.file1, args.col1, args.starts_with1),
             (args.file2, args.col2, args.starts_with2)
         ])
-        list1, list2 = results
+        (list1, lines1), (list2, lines2) = results
 
     miss2, miss1 = compare_instances(list1, list2)
 
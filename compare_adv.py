@@ -6,63 +6,133 @@ import sys
 import mmap
 import csv
 import re
-import multiprocessing
+from array import array
+from itertools import chain
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+
+from report_common import advise_sequential, has_plain_keys, is_metadata, key_field
+
+try:
+    from multiprocessing import resource_tracker, shared_memory  # Python 3.8+
+except ImportError:
+    shared_memory = None
 
 # --- Pre-compiled Regex for efficiency ---
 NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
-METADATA_KEYWORDS_SET = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-
-def is_valid_instance_line(line):
-    """Checks if a line is valid data, ignoring headers and comments."""
-    line = line.strip()
-    if not line or line.startswith(b"#"): return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword): return False
-    return True
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+CSV_BUFFER_SIZE = 1024 * 1024  # Write buffer for the comparison CSV
+CSV_BATCH_ROWS = 50000  # Pre-formatted rows joined into a single write
 
 def extract_value(value_bytes, comparison_type='numeric'):
     """Extracts a numeric or string value from a byte string."""
+    if comparison_type != 'numeric':
+        return value_bytes.decode('utf-8', errors='ignore').strip()
+    # Fast path: a plain decimal token (optional leading "-", digits at both ends, no "_" or
+    # exponent) is read by float() straight from bytes exactly as NUMERIC_RE would read it.
+    # Values are kept as full doubles on purpose: the CSV prints four decimals of values in
+    # the 1e5 range, which float32 or a 1e4-scaled int32 cannot represent.
+    head = value_bytes[1:2] if value_bytes[:1] == b"-" else value_bytes[:1]
+    if (head.isdigit() and value_bytes[-1:].isdigit() and 95 not in value_bytes  # b"_"
+            and 101 not in value_bytes and 69 not in value_bytes):  # b"e", b"E"
+        try: return float(value_bytes)
+        except ValueError: pass
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
-    if comparison_type == 'numeric':
-        match = NUMERIC_RE.search(value_str)
-        if match:
-            try: return float(match.group(0))
-            except (ValueError, TypeError): return value_str
-        else: return value_str
-    else: return value_str
+    match = NUMERIC_RE.search(value_str)
+    if match:
+        try: return float(match.group(0))
+        except (ValueError, TypeError): return value_str
+    return value_str
 
 def parse_file_with_mmap(file_path, inst_cols, value_col):
-    """Parses a file using memory-mapping for efficiency."""
-    data, instances_set = {}, set()
+    """Parses a file using memory-mapping, splitting it into lines one large chunk at a time.
+
+    Returns the data dict and its keys view, which stands in for a separate instance set.
+    """
+    data = {}
+    max_col = max(inst_cols + [value_col])
+    # Specialised to this file's shape: lines are split no further than the last wanted
+    # column, and the key columns come out of a single itemgetter call.
+    maxsplit = max_col + 1
+    get_key, multi_col_key = itemgetter(*inst_cols), len(inst_cols) > 1
     try:
-        with open(file_path, "rb") as f:
-            mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-            for line in iter(mmapped_file.readline, b""):
-                if not is_valid_instance_line(line): continue
-                parts = line.strip().split()
-                if len(parts) <= max(inst_cols + [value_col]): continue
-                try:
-                    key = tuple(parts[i].decode('utf-8', errors='ignore').strip() for i in inst_cols)
-                    val_parsed = extract_value(parts[value_col])
-                    data[key] = val_parsed
-                    instances_set.add(key)
-                except IndexError: continue
-            mmapped_file.close()
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
+            advise_sequential(mmapped_file)
+            size = mmapped_file.size()
+            offset, tail = 0, b""
+            while offset < size:
+                buf = tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]
+                raw_keys = has_plain_keys(buf)
+                offset += PARSE_CHUNK_SIZE
+                lines = buf.split(b"\n")
+                # Carry the partial last line into the next chunk (keep it on the final one).
+                tail = lines.pop() if offset < size else b""
+                for line in lines:
+                    # Split once and skip short, comment and header lines on the first token.
+                    parts = line.split(None, maxsplit)
+                    if len(parts) <= max_col or parts[0].startswith(b"#") or is_metadata(parts[0]): continue
+                    # A tuple of bytes fields per key; they are only decoded when written out.
+                    key = get_key(parts) if multi_col_key else (parts[inst_cols[0]],)
+                    if not raw_keys: key = tuple(map(key_field, key))
+                    data[key] = extract_value(parts[value_col])
     except FileNotFoundError:
         print(f"FATAL ERROR on LSF node: Cannot find file {file_path}. Exiting.")
         sys.exit(1) # Exit with an error code so LSF reports the job as failed
-    return data, instances_set
+    return data, data.keys()
+
+def parse_file_worker(args_tuple):
+    """Parses a file in the worker process and packs the result for the trip back.
+
+    All-numeric results come back through shared memory (see share_parsed); anything else,
+    or any result on Python 3.7, is returned as the dict itself.
+    """
+    data = parse_file_with_mmap(*args_tuple)[0]  # Keys views do not pickle
+    if shared_memory is None or not data:
+        return data
+    try:
+        values = array('d', data.values())
+    except TypeError:
+        return data  # String values do not fit the packed layout
+    return share_parsed(data, values)
+
+def share_parsed(data, values):
+    """Packs float64 values and the newline-joined key fields into one shared memory block."""
+    # Key fields are split tokens, so none holds a newline
+    values = values.tobytes()
+    key_len = len(next(iter(data)))
+    names = b"\n".join(chain.from_iterable(data))
+    shm = shared_memory.SharedMemory(create=True, size=len(values) + len(names))
+    shm.buf[:len(values)] = values
+    shm.buf[len(values):len(values) + len(names)] = names
+    shm.close()
+    return shm.name, len(values), len(names), key_len
 
-def compare_instances(instances1, instances2):
-    """Compares instance sets to find matched and missing instances."""
-    missing_in_file2 = sorted([i for i in instances1 if i not in instances2])
-    missing_in_file1 = sorted([i for i in instances2 if i not in instances1])
-    matched = sorted(list(instances1 & instances2))
+def load_parsed(result):
+    """Rebuilds a worker's dict from its shared memory block, then frees the block."""
+    if isinstance(result, dict):
+        return result
+    name, values_len, names_len, key_len = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = array('d')
+        values.frombytes(shm.buf[:values_len])
+        fields = bytes(shm.buf[values_len:values_len + names_len]).split(b"\n")
+    finally:
+        shm.close()
+        shm.unlink()
+    # Regroup the flat fields into key tuples without a Python-level loop
+    return dict(zip(zip(*[iter(fields)] * key_len), values))
+
+def compare_instances(data1, data2, instances1, instances2):
+    """Compares instance sets to find matched and missing instances.
+
+    Matched instances come back in file1 order rather than sorted: each shard's CSV is
+    concatenated into the final report as-is, so sorting them bought nothing.
+    """
+    # Set differences and the filter run inside C rather than through per-key Python loops.
+    missing_in_file2 = sorted(instances1 - instances2)
+    missing_in_file1 = sorted(instances2 - instances1)
+    matched = list(filter(data2.__contains__, data1))
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1, out_filename):
@@ -70,36 +140,56 @@ def write_missing_file(file1_name, file2_name, miss2, miss1, out_filename):
     with open(out_filename, "w") as out:
         if miss2:
             out.writelines([f"Instances from '{file1_name}' missing in '{file2_name}':\n", "="*60 + "\n"])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss2)
+            out.writelines(f"{b' | '.join(inst).decode('utf-8', errors='ignore')}\n" for inst in miss2)
         if miss1:
             out.writelines([f"\nInstances from '{file2_name}' missing in '{file1_name}':\n", "="*60 + "\n"])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss1)
+            out.writelines(f"{b' | '.join(inst).decode('utf-8', errors='ignore')}\n" for inst in miss1)
 
-def write_comparison_csv(file1_name, file2_name, data1, data2, matched, out_filename):
-    """Writes the detailed comparison of matched instances to a CSV file."""
+def write_comparison_csv(file1_name, file2_name, data1, data2, matched, key_len, out_filename, row_end="\r\n"):
+    """Writes the detailed comparison of matched instances to a CSV file, ending rows with row_end."""
     if not matched: return
-    with open(out_filename, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        key_len = len(matched[0]) if matched else 1
+    with open(out_filename, "w", newline="", buffering=CSV_BUFFER_SIZE) as csvfile:
+        writer = csv.writer(csvfile, lineterminator=row_end)
         headers = [f"Instance_Key_{i+1}" for i in range(key_len)] + [os.path.basename(file1_name), os.path.basename(file2_name), "Difference", "Percentage"]
         writer.writerow(headers)
+        # Numeric rows with plain keys, by far the common case, are rendered by a single
+        # %-format each instead of four f-strings, a list and a join.
+        pct_row = "%s,%.4f,%.4f,%.4f,%.2f%%" + row_end
+        inf_row = "%s,%.4f,%.4f,%.4f,Infinite" + row_end
+        batch = []
         for inst in matched:
-            val1 = data1.get(inst)
-            val2 = data2.get(inst)
-            if isinstance(val1, float) and isinstance(val2, float):
+            if len(batch) >= CSV_BATCH_ROWS:
+                csvfile.write("".join(batch)); batch.clear()
+            # Fields are ASCII or re-encoded text (see key_field), so decoding them joined is the
+            # same as joining them decoded
+            key_str = b",".join(inst).decode('utf-8', errors='ignore')
+            val1 = data1[inst]
+            val2 = data2[inst]
+            is_numeric = isinstance(val1, float) and isinstance(val2, float)
+            if is_numeric and '"' not in key_str and key_str.count(',') == key_len - 1:
+                diff = val1 - val2
+                if val2 != 0: batch.append(pct_row % (key_str, val1, val2, diff, abs((diff / val2) * 100)))
+                else: batch.append(inf_row % (key_str, val1, val2, diff))
+                continue
+            key_fields = [field.decode('utf-8', errors='ignore') for field in inst]
+            if is_numeric:
                 diff = val1 - val2
                 if val2 != 0:
                     percentage = abs((diff / val2) * 100)
                     result = f"{percentage:.2f}%"
                 else: result = "Infinite"
-                writer.writerow(list(inst) + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result])
+                fields = key_fields + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result]
             else:
                 match_result = "MATCH" if str(val1) == str(val2) else "MISMATCH"
-                writer.writerow(list(inst) + [str(val1), str(val2), "N/A", match_result])
-
-def parse_file_worker(args_tuple):
-    """Helper function for multiprocessing."""
-    return parse_file_with_mmap(*args_tuple)
+                fields = key_fields + [str(val1), str(val2), "N/A", match_result]
+            line = ",".join(fields)
+            if '"' in line or line.count(",") >= len(fields):
+                # A field needs CSV quoting: flush the batch and let csv.writer write this row.
+                csvfile.write("".join(batch)); batch.clear()
+                writer.writerow(fields)
+                continue
+            batch.append(line + row_end)
+        csvfile.write("".join(batch))
 
 def main():
     parser = argparse.ArgumentParser(description="Compares two report files.")
@@ -110,28 +200,32 @@ def main():
     parser.add_argument("--instcol2", required=True)
     parser.add_argument("--valcol2", required=True, type=int)
     parser.add_argument("--output_prefix", required=True)
+    parser.add_argument("--lf_rows", action="store_true",
+                        help="End CSV rows with \\n, not \\r\\n, so the shard merge can append them unchanged")
     args = parser.parse_args()
 
     instcol1 = list(map(int, args.instcol1.strip().split(",")))
     instcol2 = list(map(int, args.instcol2.strip().split(",")))
     
-    # Use multiprocessing to parse both files at the same time
-    with multiprocessing.Pool(2) as pool:
-        results = pool.map(parse_file_worker, [
-            (args.file1, instcol1, args.valcol1),
-            (args.file2, instcol2, args.valcol2)
-        ])
-    
-    data1, instances1 = results[0]
-    data2, instances2 = results[1]
+    # File1 is parsed in a worker process while this process parses file2, so only one
+    # result crosses back. Threads would not overlap: the parser is Python code holding the GIL.
+    if shared_memory is not None:
+        # Start the tracker before forking so the worker registers its block with this one
+        resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future1 = executor.submit(parse_file_worker, (args.file1, instcol1, args.valcol1))
+        data2, instances2 = parse_file_with_mmap(args.file2, instcol2, args.valcol2)
+        data1 = load_parsed(future1.result())
+    instances1 = data1.keys()
     
-    miss2, miss1, matched = compare_instances(instances1, instances2)
+    miss2, miss1, matched = compare_instances(data1, data2, instances1, instances2)
 
     missing_filename = f"{args.output_prefix}_missing_instances.txt"
     comparison_filename = f"{args.output_prefix}_comparison.csv"
     
     write_missing_file(os.path.basename(args.file1), os.path.basename(args.file2), miss2, miss1, missing_filename)
-    write_comparison_csv(args.file1, args.file2, data1, data2, matched, comparison_filename)
+    write_comparison_csv(args.file1, args.file2, data1, data2, matched, len(instcol1), comparison_filename,
+                         "\n" if args.lf_rows else "\r\n")
     
     print(f"Comparison for prefix {args.output_prefix} complete.")
 
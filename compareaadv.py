@@ -7,6 +7,9 @@ import mmap
 import csv
 import multiprocessing
 import re
+from operator import itemgetter
+
+from report_common import advise_sequential, has_plain_keys, is_metadata, key_field
 
 # MODIFICATION: Added an argument for output prefix
 def main():
@@ -19,6 +22,7 @@ def main():
     parser.add_argument("--valcol2", type=int, help="0-based index for the value column in file 2.")
     # THIS IS THE ONLY NEW ARGUMENT
     parser.add_argument("--output_prefix", default="result", help="Prefix for output files (e.g., 'run_0').")
+    parser.add_argument("--lf_rows", action="store_true", help="End CSV rows with \\n, not \\r\\n, so the shard merge can append them unchanged.")
     
     args = parser.parse_args()
     
@@ -59,7 +63,8 @@ def main():
     comparison_filename = f"{args.output_prefix}_comparison.csv"
     
     write_missing_file(file1_name, file2_name, miss2, miss1, missing_filename)
-    write_comparison_csv(file1_name, file2_name, data1, data2, matched, "Value1", "Value2", comparison_filename)
+    write_comparison_csv(file1_name, file2_name, data1, data2, matched, "Value1", "Value2", comparison_filename,
+                         "\n" if args.lf_rows else "\r\n")
     
     t1 = time.time()
     print(f"Run {args.output_prefix} finished in {t1 - t0:.2f} seconds.")
@@ -68,68 +73,91 @@ def main():
 
 # --- Helper Functions (No changes needed in these) ---
 NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
-METADATA_KEYWORDS_SET = {b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN", b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET", b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD", b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"}
-
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#"): return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword): return False
-    return True
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+CSV_BUFFER_SIZE = 1024 * 1024  # Write buffer for the comparison CSV
+CSV_BATCH_ROWS = 50000  # Pre-formatted rows joined into a single write
+INTERN_LIMIT = 1 << 16  # Distinct values after which a key column stops being interned
 
 def extract_value(value_bytes, comparison_type):
+    if comparison_type != 'numeric':
+        return value_bytes.decode('utf-8', errors='ignore').strip()
+    # Fast path: plain decimal bytes ("-" optional, digits at both ends, no "_" or exponent)
+    # go straight to float(), which reads them exactly as the regex would.
+    head = value_bytes[1:2] if value_bytes[:1] == b"-" else value_bytes[:1]
+    if (head.isdigit() and value_bytes[-1:].isdigit() and 95 not in value_bytes  # b"_"
+            and 101 not in value_bytes and 69 not in value_bytes):  # b"e", b"E"
+        try: return float(value_bytes)
+        except ValueError: pass
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
-    if comparison_type == 'numeric':
-        match = NUMERIC_RE.search(value_str)
-        if match:
-            try: return float(match.group(0))
-            except (ValueError, TypeError): return value_str
-        else: return value_str
-    else: return value_str
+    match = NUMERIC_RE.search(value_str)
+    if match:
+        try: return float(match.group(0))
+        except (ValueError, TypeError): return value_str
+    return value_str
 
+# Tell the kernel the file is read front to back so it reads ahead aggressively.
 def parse_file_with_mmap(file_path, inst_cols, value_col, comparison_type):
     data, instances_set = {}, set()
-    with open(file_path, "rb") as f:
-        mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        for line in iter(mmapped_file.readline, b""):
-            if not is_valid_instance_line(line): continue
-            parts = line.strip().split()
-            if len(parts) <= max(inst_cols + [value_col]): continue
-            try:
-                key = tuple(parts[i].decode('utf-8', errors='ignore').strip() for i in inst_cols)
-                val_raw = parts[value_col].decode('utf-8', errors='ignore').strip()
-                val_parsed = extract_value(parts[value_col], comparison_type)
-                data[key] = (val_raw, val_parsed)
+    max_col = max(inst_cols + [value_col])
+    # Split no further than the last wanted column and pull the key out in one C call.
+    maxsplit = max_col + 1
+    get_key, multi_col_key = itemgetter(*inst_cols), len(inst_cols) > 1
+    # Low-cardinality key columns (cell types, nets) repeat on almost every line; one table per
+    # column makes equal values share a single bytes object. Columns that turn out to be
+    # mostly unique are dropped from interning once their table passes INTERN_LIMIT.
+    interned = [(pos, {}) for pos in range(len(inst_cols))]
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
+        advise_sequential(mmapped_file)
+        size = mmapped_file.size()
+        offset, tail = 0, b""
+        while offset < size:
+            interned = [(pos, table) for pos, table in interned if len(table) < INTERN_LIMIT]
+            buf = tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]
+            raw_keys = has_plain_keys(buf)
+            offset += PARSE_CHUNK_SIZE
+            lines = buf.split(b"\n")
+            tail = lines.pop() if offset < size else b""
+            for line in lines:
+                # Split once; keywords hold no whitespace, so a header line's first token starts with one.
+                parts = line.split(None, maxsplit)
+                if len(parts) <= max_col or parts[0].startswith(b"#") or is_metadata(parts[0]): continue
+                key = get_key(parts) if multi_col_key else (parts[inst_cols[0]],)  # Decoded only when written out
+                if not raw_keys: key = tuple(map(key_field, key))
+                if interned:
+                    key = list(key)
+                    for pos, table in interned: key[pos] = table.setdefault(key[pos], key[pos])
+                    key = tuple(key)
+                data[key] = extract_value(parts[value_col], comparison_type)
                 instances_set.add(key)
-            except IndexError: continue
-        mmapped_file.close()
     return data, instances_set
 
 def compare_instances(data1, data2, instances1, instances2):
-    missing_in_file2 = sorted([i for i in instances1 if i not in instances2])
-    missing_in_file1 = sorted([i for i in instances2 if i not in instances1])
-    matched = sorted(list(instances1 & instances2))
+    missing_in_file2 = sorted(instances1 - instances2)
+    missing_in_file1 = sorted(instances2 - instances1)
+    matched = sorted(instances1 & instances2)
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1, out_filename):
     with open(out_filename, "w") as out:
         if miss2:
             out.writelines([f"{'='*60}\n", f"Instances from '{file1_name}' missing in '{file2_name}':\n", f"{'='*60}\n"])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss2)
+            out.writelines(f"{b' | '.join(inst).decode('utf-8', errors='ignore')}\n" for inst in miss2)
         if miss1:
             out.writelines([f"\n{'='*60}\n", f"Instances from '{file2_name}' missing in '{file1_name}':\n", f"{'='*60}\n"])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss1)
+            out.writelines(f"{b' | '.join(inst).decode('utf-8', errors='ignore')}\n" for inst in miss1)
 
-def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2, out_filename):
+def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2, out_filename, row_end="\r\n"):
     if not matched: return
-    with open(out_filename, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
+    with open(out_filename, "w", newline="", buffering=CSV_BUFFER_SIZE) as csvfile:
+        writer = csv.writer(csvfile, lineterminator=row_end)
         key_len = len(matched[0]) if matched else 1
         headers = [f"Instance_Key_{i+1}" for i in range(key_len)] + [f"{file1_name}_{col_name1}", f"{file2_name}_{col_name2}", "Difference", "Result"]
         writer.writerow(headers)
+        batch = []
         for inst in matched:
-            raw1, val1 = data1.get(inst, (None, None))
-            raw2, val2 = data2.get(inst, (None, None))
+            key_fields = [k.decode('utf-8', errors='ignore') for k in inst]
+            val1 = data1.get(inst)
+            val2 = data2.get(inst)
             if isinstance(val1, float) and isinstance(val2, float):
                 diff = val1 - val2
                 if val2 != 0:
@@ -137,10 +165,20 @@ def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name
                     result = f"{deviation:.2f}%"
                 else:
                     result = "Infinite %"
-                writer.writerow(list(inst) + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result])
+                fields = key_fields + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result]
             else:
                 match_result = "MATCH" if str(val1) == str(val2) else "MISMATCH"
-                writer.writerow(list(inst) + [str(val1), str(val2), "N/A", match_result])
+                fields = key_fields + [str(val1), str(val2), "N/A", match_result]
+            line = ",".join(fields)
+            if '"' in line or line.count(",") >= len(fields):
+                # A field needs CSV quoting: flush the batch and let csv.writer write this row.
+                csvfile.write("".join(batch)); batch.clear()
+                writer.writerow(fields)
+                continue
+            batch.append(line + row_end)
+            if len(batch) >= CSV_BATCH_ROWS:
+                csvfile.write("".join(batch)); batch.clear()
+        csvfile.write("".join(batch))
 
 def parse_file_worker(args_tuple):
     return parse_file_with_mmap(*args_tuple)
@@ -4,29 +4,29 @@ import time
 import psutil
 import sys
 import mmap
-import re
 import csv
+import operator
+from itertools import islice
 
-# Regex for instance pattern
-INSTANCE_RE = re.compile(rb"^\s*([A-Za-z0-9_/]+)")
+from report_common import advise_sequential, is_valid_instance_line
 
-# Keywords to ignore
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
-META_RE = re.compile(rb"^(%s)" % b"|".join(k.encode() for k in METADATA_KEYWORDS))
+# Characters allowed in an instance name; a name is the leading run of these in the first token
+INSTANCE_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_/"
 
-def is_valid_instance_line(line):
-    line = line.strip()
-    return bool(line and not line.startswith(b"#") and not META_RE.match(line))
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 65536  # Rendered CSV rows joined into a single write
+
+def instance_prefix(token):
+    # lstrip() skips the allowed characters in one C pass; what it leaves is the invalid suffix
+    return token[:len(token) - len(token.lstrip(INSTANCE_CHARS))]
 
 def extract_instance(line):
-    match = INSTANCE_RE.match(line)
-    if match:
-        return match.group(1).decode('utf-8', errors='ignore')
+    parts = line.split(None, 1)
+    if parts:
+        name = instance_prefix(parts[0])
+        if name:
+            return name.decode('utf-8', errors='ignore')
     return None
 
 def find_start_offset(mmapped_file, threshold=25, max_lines=500):
@@ -42,67 +42,87 @@ def find_start_offset(mmapped_file, threshold=25, max_lines=500):
                     return pos
     return 0
 
-def parse_file_with_mmap(file_path, value_column_index):
-    data = {}
+def map_file(file_path):
+    # The mapping stays valid after the file object is closed
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        start_offset = find_start_offset(mmapped_file)
-        mmapped_file.seek(start_offset)
+    advise_sequential(mmapped_file)
+    return mmapped_file
 
-        for line in iter(mmapped_file.readline, b""):
+def parse_file_with_mmap(mmapped_file, value_column_index):
+    data = {}
+    start_offset = find_start_offset(mmapped_file)
+    # Stop splitting after the last needed column; the rest of the line is never looked at
+    maxsplit = value_column_index + 1
+    size = mmapped_file.size()
+    offset, tail = start_offset, b""
+    while offset < size:
+        # Split one large chunk into lines at a time instead of a readline() call per line
+        lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+        offset += PARSE_CHUNK_SIZE
+        # Carry the partial last line into the next chunk (keep it on the final one)
+        tail = lines.pop() if offset < size else b""
+        for line in lines:
             if not is_valid_instance_line(line):
                 continue
-            instance_name = extract_instance(line)
-            if not instance_name:
-                continue
-            parts = line.strip().split()
-            if len(parts) <= value_column_index:
-                continue
-            value = parts[value_column_index].strip()
-            if not value:
+            # The instance name comes from the same split as the value (no separate regex pass)
+            parts = line.split(None, maxsplit)
+            instance_name = instance_prefix(parts[0])
+            if not instance_name or len(parts) <= value_column_index:
                 continue
+            # split() tokens are never empty or padded; float() parses the bytes directly
             try:
-                val = float(value)
+                val = float(parts[value_column_index])
             except ValueError:
                 continue
-            data[instance_name] = val
-        mmapped_file.close()
+            data[instance_name.decode('utf-8', errors='ignore')] = val
     return data
 
 def compare_instances(data1, data2):
-    inst1 = set(data1.keys())
-    inst2 = set(data2.keys())
+    # Dict key views do set algebra in C without first copying the keys into sets. A single
+    # sorted-merge walk was measured slower here: sorting the union costs more than sorting
+    # the three smaller results, and the walk itself runs as Python bytecode.
+    # str caches its hash, so these operations never rehash the names; swapping them for 64-bit
+    # digests (or interning them for identity compares) costs more at parse time than it saves.
+    inst1 = data1.keys()
+    inst2 = data2.keys()
     missing_in_file2 = sorted(inst1 - inst2)
     missing_in_file1 = sorted(inst2 - inst1)
     matched = sorted(inst1 & inst2)
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1):
-    with open("missing_instances.txt", "w") as out:
+    # One large write per section through a big buffer instead of a write() call per instance
+    with open("missing_instances.txt", "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         out.write(f"{'='*60}\nInstances missing from {file2_name}:\n{'='*60}\n")
-        for inst in miss2:
-            out.write(f"{inst}\n")
+        out.write("".join(f"{inst}\n" for inst in miss2))
         out.write(f"\n{'='*60}\nInstances missing from {file1_name}:\n{'='*60}\n")
-        for inst in miss1:
-            out.write(f"{inst}\n")
+        out.write("".join(f"{inst}\n" for inst in miss1))
 
 def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2):
-    with open("comparison.csv", "w", newline="") as f:
+    # Work column by column: lookups, differences and formatting run as C-level map() passes.
+    v1 = list(map(data1.__getitem__, matched))
+    v2 = list(map(data2.__getitem__, matched))
+    diffs = list(map(operator.sub, v1, v2))
+    deviations = [(diff / b * 100) if b != 0 else float('inf') for diff, b in zip(diffs, v2)]
+    # Instance names only hold INSTANCE_CHARS characters and never need CSV quoting, so rows are
+    # rendered from one template and written CSV_BATCH_ROWS at a time.
+    row_template = "%s,%.4f,%.4f,%.4f,%.2f%%\r\n"
+    rows = zip(matched, v1, v2, diffs, deviations)
+    with open("comparison.csv", "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as f:
         writer = csv.writer(f)
         writer.writerow(["Instance", f"{file1_name}_{col_name1}", f"{file2_name}_{col_name2}", "Difference", "Deviation (%)"])
-        for inst in matched:
-            v1, v2 = data1[inst], data2[inst]
-            diff = v1 - v2
-            deviation = (diff / v2 * 100) if v2 != 0 else float('inf')
-            writer.writerow([inst, f"{v1:.4f}", f"{v2:.4f}", f"{diff:.4f}", f"{deviation:.2f}%"])
-
-def get_column_name(file_path, col_index):
-    with open(file_path, "r") as f:
-        for line in f:
-            if line.strip() and not line.startswith("#"):
-                parts = line.strip().split()
-                if len(parts) > col_index:
-                    return parts[col_index]
+        for _ in range(0, len(matched), CSV_BATCH_ROWS):
+            f.write("".join(map(row_template.__mod__, islice(rows, CSV_BATCH_ROWS))))
+
+def get_column_name(mmapped_file, col_index):
+    # Reads the header from the same mapping the parser uses instead of reopening the file
+    mmapped_file.seek(0)
+    for line in iter(mmapped_file.readline, b""):
+        if line.strip() and not line.startswith(b"#"):
+            parts = line.split()
+            if len(parts) > col_index:
+                return parts[col_index].decode('utf-8', errors='ignore')
     return f"Column {col_index + 1}"
 
 def main():
@@ -124,8 +144,10 @@ def main():
 
     file1_name = os.path.basename(args.file1)
     file2_name = os.path.basename(args.file2)
-    col_name1 = get_column_name(args.file1, args.valcol1)
-    col_name2 = get_column_name(args.file2, args.valcol2)
+    mapped1 = map_file(args.file1)
+    mapped2 = map_file(args.file2)
+    col_name1 = get_column_name(mapped1, args.valcol1)
+    col_name2 = get_column_name(mapped2, args.valcol2)
 
     print("\nComparing Columns")
     print("=" * 35)
@@ -136,8 +158,10 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    data1 = parse_file_with_mmap(args.file1, args.valcol1)
-    data2 = parse_file_with_mmap(args.file2, args.valcol2)
+    data1 = parse_file_with_mmap(mapped1, args.valcol1)
+    mapped1.close()
+    data2 = parse_file_with_mmap(mapped2, args.valcol2)
+    mapped2.close()
 
     miss2, miss1, matched = compare_instances(data1, data2)
 
@@ -6,82 +6,67 @@ import sys
 import mmap
 import csv
 import multiprocessing
+from array import array
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-
-# Precompile keywords for faster check
-METADATA_KEYWORDS_SET = set(METADATA_KEYWORDS)
-
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#"):
-        return False
-    # Check if line starts with any metadata keyword
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword):
-            return False
-    return True
-
-def parse_file_with_mmap(file_path, inst_col, value_col):
+from report_common import advise_sequential, is_valid_instance_line
+
+try:
+    from multiprocessing import resource_tracker, shared_memory  # Python 3.8+
+except ImportError:
+    shared_memory = None
+
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+PARSE_RANGE_SIZE = 64 * 1024 * 1024  # Bytes of a file handed to each parsing worker
+INF = float('inf')
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024  # Write buffer for comparison.csv
+CSV_BATCH_ROWS = 65536  # Rendered rows joined into a single write; bounds the pending row list
+
+def parse_file_with_mmap(file_path, inst_col, value_col, start=0, end=None):
+    # Parses the lines that start inside the byte range [start, end) (the whole file by default)
+    # and counts the newlines in it, so the line statistic needs no second pass over the file
     data = {}
     instances_set = set()
+    line_count = 0
+    max_col = max(inst_col, value_col)
+    maxsplit = max_col + 1
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        # Read in chunks to reduce overhead
-        chunk_size = 1024 * 1024  # 1MB chunk
+        advise_sequential(mmapped_file)
+        size = mmapped_file.size()
+        # A line straddling `start` belongs to the previous range; the last line starting
+        # before `end` is read through to its newline
+        offset = 0 if start == 0 else (mmapped_file.find(b"\n", start - 1) + 1) or size
+        stop = size if end is None or end >= size else (mmapped_file.find(b"\n", end - 1) + 1) or size
         buffer = b""
-        while True:
-            chunk = mmapped_file.read(chunk_size)
-            if not chunk:
-                break
-            buffer += chunk
-            lines = buffer.split(b"\n")
-            # Keep last partial line in buffer
-            buffer = lines.pop()
+        while offset < stop:
+            # Split the file into lines one large chunk at a time
+            lines = (buffer + mmapped_file[offset:min(offset + PARSE_CHUNK_SIZE, stop)]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            line_count += len(lines) - 1
+            # Keep last partial line in buffer (the final chunk has none left over)
+            buffer = lines.pop() if offset < stop else b""
             for line in lines:
-                if not is_valid_instance_line(line):
-                    continue
-                parts = line.strip().split()
-                if len(parts) <= max(inst_col, value_col):
-                    continue
-                value = parts[value_col].strip()
-                if not value:
+                # Split once, and no further than the last needed column; comment and metadata
+                # lines are recognised by their first token
+                parts = line.split(None, maxsplit)
+                if len(parts) <= max_col or not is_valid_instance_line(parts[0]):
                     continue
+                # split() tokens are never empty or padded; float() parses the bytes directly
                 try:
-                    val = float(value)
+                    val = float(parts[value_col])
                 except ValueError:
                     continue
                 instance = parts[inst_col].decode('utf-8', errors='ignore')
                 data[instance] = val
                 instances_set.add(instance)
-        # Process last buffered line if any
-        if buffer:
-            line = buffer
-            if is_valid_instance_line(line):
-                parts = line.strip().split()
-                if len(parts) > max(inst_col, value_col):
-                    value = parts[value_col].strip()
-                    if value:
-                        try:
-                            val = float(value)
-                            instance = parts[inst_col].decode('utf-8', errors='ignore')
-                            data[instance] = val
-                            instances_set.add(instance)
-                        except ValueError:
-                            pass
         mmapped_file.close()
-    return data, instances_set
+    return data, instances_set, line_count
 
 def compare_instances(data1, data2, instances1, instances2):
-    missing_in_file2 = sorted([i for i in instances1 if i not in instances2])
-    missing_in_file1 = sorted([i for i in instances2 if i not in instances1])
-    matched = sorted(list(instances1 & instances2))
+    # Set differences run in C instead of a Python membership test per instance
+    missing_in_file2 = sorted(instances1 - instances2)
+    missing_in_file1 = sorted(instances2 - instances1)
+    matched = sorted(instances1 & instances2)
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1):
@@ -100,20 +85,29 @@ def write_missing_file(file1_name, file2_name, miss2, miss1):
         out.writelines(f"{inst}\n" for inst in miss1)
 
 def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2):
-    with open("comparison.csv", "w", newline="") as csvfile:
+    with open("comparison.csv", "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Instance", f"{file1_name}_{col_name1}", f"{file2_name}_{col_name2}", "Difference", "Deviation (%)"])
+        # One precompiled template renders a whole row in a single %-format call; only instance
+        # names that need CSV quoting are handed to csv.writer
+        row_template = "%s,%.4f,%.4f,%.4f,%.2f%%\r\n"
         rows = []
         for inst in matched:
             val1 = data1[inst]
             val2 = data2[inst]
             diff = val1 - val2
-            try:
-                deviation = (diff / val2) * 100 if val2 != 0 else float('inf')
-            except:
-                deviation = 0
-            rows.append([inst, f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", f"{deviation:.2f}%"])
-        writer.writerows(rows)
+            # Float division by a non-zero value cannot raise, so no per-row try/except is needed
+            deviation = (diff / val2) * 100 if val2 != 0 else INF
+            if '"' in inst or ',' in inst:
+                csvfile.write("".join(rows))
+                rows.clear()
+                writer.writerow([inst, f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", f"{deviation:.2f}%"])
+            else:
+                rows.append(row_template % (inst, val1, val2, diff, deviation))
+                if len(rows) >= CSV_BATCH_ROWS:
+                    csvfile.write("".join(rows))
+                    rows.clear()
+        csvfile.write("".join(rows))
 
 def get_column_name(file_path, col_index):
     with open(file_path, 'r') as f:
@@ -126,21 +120,55 @@ def get_column_name(file_path, col_index):
                     return f"Column {col_index + 1}"
     return f"Column {col_index + 1}"
 
-def count_lines(path):
-    # Use chunked reading to count newlines in binary mode
-    with open(path, 'rb') as f:
-        count = 0
-        chunk_size = 1024 * 1024
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            count += chunk.count(b'\n')
-    return count
-
 def parse_file_worker(args):
-    file_path, inst_col, val_col = args
-    return parse_file_with_mmap(file_path, inst_col, val_col)
+    file_path, inst_col, val_col, start, end = args
+    # Only the parsed range and line count are sent back; the instance set is rebuilt after merging
+    data, _, line_count = parse_file_with_mmap(file_path, inst_col, val_col, start, end)
+    if shared_memory is None or not data:
+        return data, line_count
+    return share_parsed_range(data), line_count
+
+def share_parsed_range(data):
+    # Pack values (float64) and newline-joined names into one shared memory block, so only the
+    # block's name goes back through the pool's pipe instead of a pickled dict
+    values = array('d', data.values()).tobytes()
+    names = "\n".join(data).encode('utf-8')
+    shm = shared_memory.SharedMemory(create=True, size=len(values) + len(names))
+    shm.buf[:len(values)] = values
+    shm.buf[len(values):len(values) + len(names)] = names
+    shm.close()
+    return shm.name, len(values), len(names)
+
+def load_parsed_range(block):
+    name, values_len, names_len = block
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = array('d')
+        values.frombytes(shm.buf[:values_len])
+        names = str(shm.buf[values_len:values_len + names_len], 'utf-8').split("\n")
+    finally:
+        shm.close()
+        shm.unlink()
+    return names, values
+
+def split_into_ranges(file_path, inst_col, val_col):
+    size = os.path.getsize(file_path)
+    return [(file_path, inst_col, val_col, start, start + PARSE_RANGE_SIZE)
+            for start in range(0, max(size, 1), PARSE_RANGE_SIZE)]
+
+def merge_parsed_ranges(results):
+    # Ranges arrive in file order, so later duplicates still win as in a single pass. Names are
+    # interned here rather than in the workers (each process has its own intern table), so an
+    # instance found in both files ends up as one shared string object.
+    data, line_count = {}, 0
+    for range_data, range_lines in results:
+        if isinstance(range_data, dict):
+            names, values = range_data, range_data.values()
+        else:
+            names, values = load_parsed_range(range_data)
+        data.update(zip(map(sys.intern, names), values))
+        line_count += range_lines
+    return data, set(data), line_count
 
 def main():
     parser = argparse.ArgumentParser(description="Compare two files and report missing instances + CSV comparison")
@@ -181,18 +209,17 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    lines1 = count_lines(args.file1)
-    lines2 = count_lines(args.file2)
-
-    # Use multiprocessing to parse files in parallel
-    with multiprocessing.Pool(2) as pool:
-        results = pool.map(parse_file_worker, [
-            (args.file1, args.instcol1, args.valcol1),
-            (args.file2, args.instcol2, args.valcol2)
-        ])
-
-    data1, instances1 = results[0]
-    data2, instances2 = results[1]
+    # Parse both files in byte ranges spread over every core instead of one process per file
+    ranges1 = split_into_ranges(args.file1, args.instcol1, args.valcol1)
+    ranges2 = split_into_ranges(args.file2, args.instcol2, args.valcol2)
+    if shared_memory is not None:
+        # Start the tracker before forking so the workers register their blocks with this one
+        resource_tracker.ensure_running()
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        results = pool.map(parse_file_worker, ranges1 + ranges2)
+
+    data1, instances1, lines1 = merge_parsed_ranges(results[:len(ranges1)])
+    data2, instances2, lines2 = merge_parsed_ranges(results[len(ranges1):])
 
     miss2, miss1, matched = compare_instances(data1, data2, instances1, instances2)
 
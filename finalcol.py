@@ -6,28 +6,35 @@ import mmap
 import csv
 import multiprocessing
 import re
+import pickle
+import hashlib
+from array import array
+from itertools import chain
+from operator import itemgetter
+
+from report_common import advise_sequential, has_plain_keys, is_valid_instance_line, key_field
+
+try:
+    from multiprocessing import resource_tracker, shared_memory  # Python 3.8+
+except ImportError:
+    shared_memory = None
 
 # Pre-compile the regex for numeric extraction for efficiency
 NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
 
-METADATA_KEYWORDS = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-METADATA_KEYWORDS_SET = set(METADATA_KEYWORDS)
-
-def is_valid_instance_line(line):
-    """Checks if a line is a valid instance data line."""
-    line = line.strip()
-    if not line or line.startswith(b"#"):
-        return False
-    # Check against a set of known metadata keywords to exclude header lines
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword):
-            return False
-    return True
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files, so batches reach disk in few syscalls
+CSV_BATCH_ROWS = 50000  # Pre-formatted rows joined into a single write
+CACHE_FORMAT = 4  # Bumped whenever the layout of the parsed data changes
+
+def is_plain_number(value_bytes):
+    """Checks that float() would read the token exactly as NUMERIC_RE does.
+
+    Rules out inf/nan, "1_0" and exponents (float() reads "1.e5" as 1e5, the regex as 1); any
+    other token ending in a digit that float() parses is a full regex match.
+    """
+    return (value_bytes[-1:].isdigit() and 95 not in value_bytes  # b"_"
+            and 101 not in value_bytes and 69 not in value_bytes)  # b"e", b"E"
 
 def extract_value(value_bytes, comparison_type):
     """
@@ -40,6 +47,13 @@ def extract_value(value_bytes, comparison_type):
     Returns:
         The parsed value, which can be a float or a string.
     """
+    if comparison_type == 'numeric' and is_plain_number(value_bytes):
+        # Fast path: a plain decimal token is parsed straight from bytes, skipping the regex
+        try:
+            return float(value_bytes)
+        except ValueError:
+            pass
+
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
 
     if comparison_type == 'numeric':
@@ -62,56 +76,76 @@ def extract_value(value_bytes, comparison_type):
 def parse_file_with_mmap(file_path, inst_cols, value_col, comparison_type):
     """Parses a file using memory-mapping for efficiency."""
     data = {}
-    instances_set = set()
+    # Split no further than the last wanted column; the rest of the line is never looked at
+    max_col = max(inst_cols + [value_col])
+    maxsplit = max_col + 1
+    get_key, multi_col_key = itemgetter(*inst_cols), len(inst_cols) > 1
     with open(file_path, "rb") as f:
         # Use memory-mapping for efficient read access
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        advise_sequential(mmapped_file)
         
-        # Process the file line by line
-        for line in iter(mmapped_file.readline, b""):
-            if not is_valid_instance_line(line):
-                continue
-            
-            parts = line.strip().split()
-            if len(parts) <= max(inst_cols + [value_col]):
-                continue
-            
-            try:
-                # Create a key from one or more instance columns
-                key = tuple(parts[i].decode('utf-8', errors='ignore').strip() for i in inst_cols)
-                
-                # Get the raw value for reporting purposes
-                val_raw = parts[value_col].decode('utf-8', errors='ignore').strip()
-                
-                # Parse the value using the selected comparison type
-                val_parsed = extract_value(parts[value_col], comparison_type)
-                
-                data[key] = (val_raw, val_parsed)
-                instances_set.add(key)
-            except IndexError:
-                # This handles cases where a line has fewer columns than expected
-                continue
+        # Split one large chunk into lines at a time instead of one readline() call per line
+        size = mmapped_file.size()
+        offset, tail = 0, b""
+        while offset < size:
+            chunk = tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]
+            # A chunk of plain ASCII (the norm) keys on the raw tokens; any other chunk has
+            # each key field normalised like the decoded and stripped text (see key_field)
+            raw_keys = has_plain_keys(chunk)
+            lines = chunk.split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            # Carry the partial last line into the next chunk (keep it on the final one)
+            tail = lines.pop() if offset < size else b""
+            for line in lines:
+                if not is_valid_instance_line(line):
+                    continue
+
+                parts = line.split(None, maxsplit)
+                if len(parts) <= max_col:
+                    continue
+
+                try:
+                    # Key on the raw bytes tokens of one or more instance columns; they are only
+                    # decoded for the instances that get written out (see key_fields)
+                    key = get_key(parts) if multi_col_key else (parts[inst_cols[0]],)
+                    if not raw_keys:
+                        key = tuple(map(key_field, key))
+
+                    # Only the parsed value is kept; the raw text was never reported, and a
+                    # (raw, parsed) tuple per key cost an extra object and string for every row
+                    data[key] = extract_value(parts[value_col], comparison_type)
+                except IndexError:
+                    # This handles cases where a line has fewer columns than expected
+                    continue
 
         mmapped_file.close()
-    return data, instances_set
+    # No separate instance set: the dict's keys view does the set algebra in compare_instances
+    return data
+
+def key_fields(key):
+    """Decodes a bytes key into the text fields written to the output files."""
+    return [part.decode('utf-8', errors='ignore').strip() for part in key]
 
 def compare_instances(data1, data2, instances1, instances2):
     """Compares instance sets to find matched and missing instances."""
-    missing_in_file2 = sorted([i for i in instances1 if i not in instances2])
-    missing_in_file1 = sorted([i for i in instances2 if i not in instances1])
-    matched = sorted(list(instances1 & instances2))
+    # Set differences run in C instead of a Python-level membership test per key; sorting both
+    # key lists for a two-pointer merge walk was measured slower, as the walk runs as bytecode
+    missing_in_file2 = sorted(instances1 - instances2)
+    missing_in_file1 = sorted(instances2 - instances1)
+    matched = sorted(instances1 & instances2)
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1):
     """Writes instances that are not found in the other file to 'missing_instances.txt'."""
-    with open("missing_instances.txt", "w") as out:
+    with open("missing_instances.txt", "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         if miss2:
             out.writelines([
                 f"{'='*60}\n",
                 f"Instances from '{file1_name}' missing in '{file2_name}':\n",
                 f"{'='*60}\n",
             ])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss2)
+            out.writelines(f"{' | '.join(key_fields(inst))}\n" for inst in miss2)
         
         if miss1:
             out.writelines([
@@ -119,7 +153,7 @@ def write_missing_file(file1_name, file2_name, miss2, miss1):
                 f"Instances from '{file2_name}' missing in '{file1_name}':\n",
                 f"{'='*60}\n",
             ])
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss1)
+            out.writelines(f"{' | '.join(key_fields(inst))}\n" for inst in miss1)
 
 def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2):
     """Writes the detailed comparison of matched instances to 'comparison.csv'."""
@@ -127,7 +161,7 @@ def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name
         print("\nNo matched instances found to compare.")
         return
 
-    with open("comparison.csv", "w", newline="") as csvfile:
+    with open("comparison.csv", "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         
         # Create dynamic headers based on the number of key columns
@@ -137,12 +171,35 @@ def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name
         ]
         writer.writerow(headers)
 
+        # Numeric rows whose key fields need no CSV quoting, the common case, are rendered by a
+        # single %-format each and written CSV_BATCH_ROWS at a time instead of per writerow()
+        pct_row = "%s,%.4f,%.4f,%.4f,%.2f%%\r\n"
+        inf_row = "%s,%.4f,%.4f,%.4f,Infinite %%\r\n"
+        batch = []
         for inst in matched:
-            raw1, val1 = data1[inst]
-            raw2, val2 = data2[inst]
+            val1 = data1[inst]
+            val2 = data2[inst]
+            is_numeric = isinstance(val1, float) and isinstance(val2, float)
+
+            fields = key_fields(inst)
+            key_str = ",".join(fields)
+            if is_numeric and '"' not in key_str and key_str.count(",") == key_len - 1:
+                diff = val1 - val2
+                if val2 != 0:
+                    batch.append(pct_row % (key_str, val1, val2, diff, abs((diff / val2) * 100)))
+                else:
+                    batch.append(inf_row % (key_str, val1, val2, diff))
+                if len(batch) >= CSV_BATCH_ROWS:
+                    csvfile.write("".join(batch))
+                    batch.clear()
+                continue
+            # Anything else goes through csv.writer, after the rows rendered before it
+            if batch:
+                csvfile.write("".join(batch))
+                batch.clear()
 
             # Perform numeric comparison if both values were successfully parsed as floats
-            if isinstance(val1, float) and isinstance(val2, float):
+            if is_numeric:
                 diff = val1 - val2
                 # Handle division by zero for deviation calculation
                 if val2 != 0:
@@ -152,11 +209,12 @@ def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name
                 else:
                     # MODIFIED: Simplified result for division by zero
                     result = "Infinite %"
-                writer.writerow(list(inst) + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result])
+                writer.writerow(fields + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result])
             else:
                 # Otherwise, perform a string comparison
                 match_result = "MATCH" if str(val1) == str(val2) else "MISMATCH"
-                writer.writerow(list(inst) + [str(val1), str(val2), "N/A", match_result])
+                writer.writerow(fields + [str(val1), str(val2), "N/A", match_result])
+        csvfile.write("".join(batch))
 
 def get_column_name(file_path, col_index):
     """Reads the first valid data line of a file to get a column name."""
@@ -170,9 +228,84 @@ def get_column_name(file_path, col_index):
                 break # Stop after the first valid line
     return f"Column_{col_index + 1}"
 
+def cache_path_for(file_path, inst_cols, value_col, comparison_type):
+    """Returns the cache file for this input and parse settings, next to the input file."""
+    st = os.stat(file_path)
+    # The file's size and mtime are part of the key, so an edited report never hits a stale cache
+    key = repr((CACHE_FORMAT, os.path.abspath(file_path), st.st_size, st.st_mtime_ns, inst_cols, value_col, comparison_type))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.{digest}.cache")
+
+def parse_file_cached(file_path, inst_cols, value_col, comparison_type):
+    """Loads the parsed data from the cache when present, otherwise parses and stores it."""
+    cache_path = cache_path_for(file_path, inst_cols, value_col, comparison_type)
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    data = parse_file_with_mmap(file_path, inst_cols, value_col, comparison_type)
+    try:
+        # Write under a temporary name first so a concurrent run never reads a partial cache
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # An unwritable directory only costs the cache, not the run
+    return data
+
+def parse_file(args_tuple):
+    """Parses one file, through the cache when it is enabled."""
+    *parse_args, use_cache = args_tuple
+    if use_cache:
+        return parse_file_cached(*parse_args)
+    return parse_file_with_mmap(*parse_args)
+
 def parse_file_worker(args_tuple):
-    """Helper function to allow multiprocessing.Pool to call the parsing function."""
-    return parse_file_with_mmap(*args_tuple)
+    """Helper function to allow multiprocessing.Pool to call the parsing function.
+
+    All-numeric results come back through shared memory (see share_parsed); anything else,
+    or any result on Python 3.7, is returned as the dict itself.
+    """
+    data = parse_file(args_tuple)
+    if shared_memory is None or not data:
+        return data
+    try:
+        values = array('d', data.values())
+    except TypeError:
+        return data  # String values do not fit the packed layout
+    return share_parsed(data, values)
+
+def share_parsed(data, values):
+    """Packs float64 values and the newline-joined key fields into one shared memory block.
+
+    Only the block's name and sizes go back through the pool's pipe instead of a pickled dict.
+    """
+    values = values.tobytes()
+    fields = b"\n".join(chain.from_iterable(data))
+    shm = shared_memory.SharedMemory(create=True, size=len(values) + len(fields))
+    shm.buf[:len(values)] = values
+    shm.buf[len(values):len(values) + len(fields)] = fields
+    shm.close()
+    return shm.name, len(values), len(fields)
+
+def load_parsed(result, key_len):
+    """Rebuilds a worker's dict from its shared memory block, then frees the block."""
+    if isinstance(result, dict):
+        return result
+    name, values_len, fields_len = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = array('d')
+        values.frombytes(shm.buf[:values_len])
+        fields = bytes(shm.buf[values_len:values_len + fields_len]).split(b"\n")
+    finally:
+        shm.close()
+        shm.unlink()
+    # Split tokens never contain a newline, so every key_len fields form one key again
+    return dict(zip(zip(*[iter(fields)] * key_len), values))
 
 def main():
     parser = argparse.ArgumentParser(description="Compare two files, with user-defined keys and advanced value comparison.")
@@ -182,6 +315,7 @@ def main():
     parser.add_argument("--file2", help="Path to the second file.")
     parser.add_argument("--instcol2", help="Comma-separated 0-based index(es) for instance key columns in file 2.")
     parser.add_argument("--valcol2", type=int, help="0-based index for the value column in file 2.")
+    parser.add_argument("--cache", action="store_true", help="Reuse parsed results cached next to each input file.")
     args = parser.parse_args()
 
     # --- Interactive Prompts if arguments are not provided ---
@@ -211,23 +345,22 @@ def main():
     file2_name = os.path.basename(args.file2)
 
     # --- Parallel Processing Setup ---
-    with multiprocessing.Pool(2) as pool:
-        # Get column names in parallel with parsing
-        col_name1_future = pool.apply_async(get_column_name, (args.file1, args.valcol1))
-        col_name2_future = pool.apply_async(get_column_name, (args.file2, args.valcol2))
-        
-        # Parse files in parallel
-        parse_results_future = pool.map_async(parse_file_worker, [
-            (args.file1, instcol1, args.valcol1, comparison_type),
-            (args.file2, instcol2, args.valcol2, comparison_type)
-        ])
-        
-        col_name1 = col_name1_future.get()
-        col_name2 = col_name2_future.get()
-        results = parse_results_future.get()
+    # File 1 is parsed in a worker process while this process parses file 2 itself, so only one
+    # result is pickled back. Threads would not overlap: the parser is Python code holding the GIL.
+    if shared_memory is not None:
+        # Start the tracker before forking so the worker registers its block with this one
+        resource_tracker.ensure_running()
+    with multiprocessing.Pool(1) as pool:
+        result1_future = pool.apply_async(parse_file_worker, (
+            (args.file1, instcol1, args.valcol1, comparison_type, args.cache),))
 
-    data1, instances1 = results[0]
-    data2, instances2 = results[1]
+        # Column names only read the first lines, so they are looked up here meanwhile
+        col_name1 = get_column_name(args.file1, args.valcol1)
+        col_name2 = get_column_name(args.file2, args.valcol2)
+        data2 = parse_file((args.file2, instcol2, args.valcol2, comparison_type, args.cache))
+        data1 = load_parsed(result1_future.get(), len(instcol1))
+    # Keys views are not picklable, so they are taken here rather than returned by the workers
+    instances1, instances2 = data1.keys(), data2.keys()
 
     print("\nComparing Columns")
     print("=" * 35)
@@ -5,6 +5,7 @@ import time
 import psutil
 
 SCRIPT_VERSION = "1.9.0"
+CSV_BATCH_ROWS = 50000  # Rendered rows joined into a single write
 
 def get_relevant_lines(file_path):
     with open(file_path, "r") as f:
@@ -13,87 +14,44 @@ def get_relevant_lines(file_path):
     # Find last line with "Instance" or "Instance/pin"
     last_header = -1
     for i, line in enumerate(lines):
-        header = line.strip().lower()
-        if header.startswith("instance") or header.startswith("instance/pin"):
+        # Lower-case only the 8 characters compared instead of the whole line; "instance/pin"
+        # starts with "instance", so one check covers both headers
+        if line.lstrip()[:8].lower() == "instance":
             last_header = i
     return lines[last_header + 1:] if last_header >= 0 else []
 
 def parse_joined_lines(lines, column_number):
-    values = {}
-    col_index = column_number - 1
-    buffer = ""
-
-    for line in lines:
-        line = line.rstrip()
-        if not line.strip() or line.startswith("*") or line.startswith("="):
-            continue
-
-        # If line starts with a space, it’s likely a continuation of the previous instance name
-        if line.startswith(" ") or line.startswith("\t"):
-            buffer += " " + line.strip()
-            continue
-        else:
-            if buffer:
-                full = buffer.strip()
-                parts = full.split()
-                if len(parts) > col_index:
-                    try:
-                        instance = parts[0]
-                        value = float(parts[col_index])
-                        values[instance] = value
-                    except:
-                        pass
-            buffer = line.strip()
-
-    # Process the last buffered line
-    if buffer:
-        full = buffer.strip()
-        parts = full.split()
-        if len(parts) > col_index:
-            try:
-                instance = parts[0]
-                value = float(parts[col_index])
-                values[instance] = value
-            except:
-                pass
-
-    return values
+    return dict(stream_joined_lines(lines, column_number))
 
 def stream_joined_lines(lines, column_number):
     col_index = column_number - 1
-    buffer = ""
+    # Tokens of the record being built; continuation lines extend it in place instead of
+    # growing a string with += and splitting it again
+    parts = []
 
     for line in lines:
+        # After rstrip() a blank line is empty, so the first character decides everything
         line = line.rstrip()
-        if not line.strip() or line.startswith("*") or line.startswith("="):
+        if not line or line[0] in "*=":
             continue
 
-        if line.startswith(" ") or line.startswith("\t"):
-            buffer += " " + line.strip()
+        # If line starts with a space, it’s likely a continuation of the previous instance name
+        if line[0] in " \t":
+            parts.extend(line.split())
             continue
-        else:
-            if buffer:
-                full = buffer.strip()
-                parts = full.split()
-                if len(parts) > col_index:
-                    try:
-                        instance = parts[0]
-                        value = float(parts[col_index])
-                        yield instance, value
-                    except:
-                        pass
-            buffer = line.strip()
-
-    if buffer:
-        full = buffer.strip()
-        parts = full.split()
-        if len(parts) > col_index:
+        if parts and len(parts) > col_index:
             try:
-                instance = parts[0]
-                value = float(parts[col_index])
-                yield instance, value
+                yield parts[0], float(parts[col_index])
             except:
                 pass
+        parts = line.split()
+
+    # Process the last buffered record
+    if parts and len(parts) > col_index:
+        try:
+            yield parts[0], float(parts[col_index])
+        except:
+            pass
 
 def compare_files(file1, file2, column_number):
     print(f"\n🔍 Comparing column {column_number} in '{file1}' vs '{file2}' — v{SCRIPT_VERSION}")
@@ -116,20 +74,35 @@ def compare_files(file1, file2, column_number):
         writer.writerow([])
         writer.writerow(["Instance", "File1 Value", "File2 Value", "Difference", "Percent Difference"])
 
+        # File2 is joined against file1's dict as it streams. Both values are always floats, so
+        # the only row that cannot be formatted is val1 == 0: its "NA" percentage never made it
+        # into the CSV, but its difference still counts. Rows whose instance needs no CSV
+        # quoting are rendered by one %-format and written in batches.
+        row_template = "%s,%.6f,%.6f,%.6f,%.2f%%\r\n"
+        rows = []
+        get_val1 = data1.get
         for instance, val2 in stream_joined_lines(lines2, column_number):
             count2 += 1
-            val1 = data1.get(instance, "Missing")
-            if val1 == "Missing" or val1 == val2:
+            val1 = get_val1(instance)
+            if val1 is None or val1 == val2:
                 continue
-            try:
-                diff = abs(val1 - val2)
-                if diff == 0:
-                    continue
-                pct = (diff / val1 * 100) if val1 != 0 else "NA"
-                differences.append(diff)
-                writer.writerow([instance, f"{val1:.6f}", f"{val2:.6f}", f"{diff:.6f}", f"{pct:.2f}%"])
-            except:
+            diff = abs(val1 - val2)
+            if diff == 0:
                 continue
+            differences.append(diff)
+            if val1 == 0:
+                continue
+            pct = diff / val1 * 100
+            if '"' in instance or ',' in instance:
+                f.write("".join(rows))
+                rows.clear()
+                writer.writerow([instance, f"{val1:.6f}", f"{val2:.6f}", f"{diff:.6f}", f"{pct:.2f}%"])
+            else:
+                rows.append(row_template % (instance, val1, val2, diff, pct))
+                if len(rows) >= CSV_BATCH_ROWS:
+                    f.write("".join(rows))
+                    rows.clear()
+        f.write("".join(rows))
 
     runtime = round(time.time() - start_time, 2)
     mem = round(psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024), 2)
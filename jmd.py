@@ -7,30 +7,47 @@ import mmap
 import csv
 import multiprocessing
 import re
+from array import array
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-METADATA_KEYWORDS_SET = set(METADATA_KEYWORDS)
-
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#"):
-        return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line.startswith(keyword):
-            return False
-    return True
+from report_common import advise_sequential, is_valid_instance_line
+
+try:
+    from multiprocessing import resource_tracker, shared_memory  # Python 3.8+
+except ImportError:
+    shared_memory = None
+
+# Compiled once at import instead of looked up in re's pattern cache on every value
+NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
+
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 50000  # Rendered rows joined into a single write
+INF = float('inf')
+
+def is_plain_number(value_bytes):
+    # Rules out inf/nan, "1_0" and exponents (float() reads "1.e5" as 1e5, the regex as 1); any
+    # other token ending in a digit that float() parses is read the same way by both
+    return (value_bytes[-1:].isdigit() and 95 not in value_bytes  # b"_"
+            and 101 not in value_bytes and 69 not in value_bytes)  # b"e", b"E"
+
+def key_field(field_bytes):
+    # Bytes name matching the baseline's decode(errors='ignore'); ASCII names skip the decode
+    if field_bytes.isascii():
+        return field_bytes
+    return field_bytes.decode('utf-8', errors='ignore').encode()
 
 def extract_value(value_bytes):
+    # Fast path: a plain decimal token is parsed straight from bytes, skipping the regex
+    if is_plain_number(value_bytes):
+        try:
+            return float(value_bytes)
+        except ValueError:
+            pass
+
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
 
     # Always try to extract a number, even from "1324.24," or "(1234.5)"
-    match = re.search(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", value_str)
+    match = NUMERIC_RE.search(value_str)
     if match:
         try:
             return float(match.group())
@@ -42,85 +59,94 @@ def extract_value(value_bytes):
 
 def parse_file_with_mmap(file_path, inst_col, value_col):
     data = {}
-    instances_set = set()
+    line_count = 0  # Newlines seen, so the line statistic needs no separate pass over the file
+    # Split no further than the last wanted column; the rest of the line is never looked at
+    max_col = max(inst_col, value_col)
+    maxsplit = max_col + 1
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        chunk_size = 1024 * 1024
-        buffer = b""
-        while True:
-            chunk = mmapped_file.read(chunk_size)
-            if not chunk:
-                break
-            buffer += chunk
-            lines = buffer.split(b"\n")
-            buffer = lines.pop()
+        advise_sequential(mmapped_file)
+        size = mmapped_file.size()
+        offset, tail = 0, b""
+        while offset < size:
+            # Slice the mapping directly; only the partial last line is carried over and joined
+            # to the next chunk, and the final chunk keeps it, so the end needs no special case
+            lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            line_count += len(lines) - 1
+            tail = lines.pop() if offset < size else b""
             for line in lines:
                 if not is_valid_instance_line(line):
                     continue
-                parts = line.strip().split()
-                if len(parts) <= max(inst_col, value_col):
+                parts = line.split(None, maxsplit)
+                if len(parts) <= max_col:
                     continue
-                value = parts[value_col].strip()
-                if not value:
-                    continue
-                instance = parts[inst_col].decode('utf-8', errors='ignore')
-                parsed_val = extract_value(value)
-                if parsed_val is not None:
-                    data[instance] = parsed_val
-                    instances_set.add(instance)
-        if buffer:
-            line = buffer
-            if is_valid_instance_line(line):
-                parts = line.strip().split()
-                if len(parts) > max(inst_col, value_col):
-                    value = parts[value_col].strip()
-                    if value:
-                        instance = parts[inst_col].decode('utf-8', errors='ignore')
-                        parsed_val = extract_value(value)
-                        if parsed_val is not None:
-                            data[instance] = parsed_val
-                            instances_set.add(instance)
+                # Bytes keys; names are only decoded for the instances that get written out.
+                # split() tokens are never empty or padded, so the value goes to extract_value
+                # as is, and extract_value always returns a float or a string.
+                instance = key_field(parts[inst_col])
+                data[instance] = extract_value(parts[value_col])
         mmapped_file.close()
-    return data, instances_set
+    return data, line_count
 
 def compare_instances(data1, data2, instances1, instances2):
-    missing_in_file2 = sorted([i for i in instances1 if i not in instances2])
-    missing_in_file1 = sorted([i for i in instances2 if i not in instances1])
-    matched = sorted(list(instances1 & instances2))
+    # Three C-level set operations and sorts; one sorted union plus a merge walk was measured
+    # slower, as sorting the union costs more than the three smaller sorts and the walk is bytecode
+    missing_in_file2 = sorted(instances1 - instances2)
+    missing_in_file1 = sorted(instances2 - instances1)
+    matched = sorted(instances1 & instances2)
     return missing_in_file2, missing_in_file1, matched
 
 def write_missing_file(file1_name, file2_name, miss2, miss1):
-    with open("missing_instances.txt", "w") as out:
+    # One decode and write per section through a large buffer instead of one per instance; a
+    # newline byte never continues a UTF-8 sequence, so decoding the joined names is equivalent
+    with open("missing_instances.txt", "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         out.writelines([
             f"{'='*60}\n",
             f"Instances missing from {file2_name}:\n",
             f"{'='*60}\n",
         ])
-        out.writelines(f"{inst}\n" for inst in miss2)
+        out.write(b"".join(inst + b"\n" for inst in miss2).decode('utf-8', errors='ignore'))
         out.writelines([
             f"\n{'='*60}\n",
             f"Instances missing from {file1_name}:\n",
             f"{'='*60}\n",
         ])
-        out.writelines(f"{inst}\n" for inst in miss1)
+        out.write(b"".join(inst + b"\n" for inst in miss1).decode('utf-8', errors='ignore'))
 
 def write_comparison_csv(file1_name, file2_name, data1, data2, matched, col_name1, col_name2):
-    with open("comparison.csv", "w", newline="") as csvfile:
+    with open("comparison.csv", "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Instance", f"{file1_name}_{col_name1}", f"{file2_name}_{col_name2}", "Difference", "Deviation / Match"])
+        # Numeric rows are rendered by one prebuilt %-template each instead of four f-strings and a
+        # writerow() call; only names that need CSV quoting still go through the writer
+        row_template = "%s,%.4f,%.4f,%.4f,%.2f%%\r\n"
+        rows = []
         for inst in matched:
             val1 = data1[inst]
             val2 = data2[inst]
+            inst = inst.decode('utf-8', errors='ignore')
             if isinstance(val1, float) and isinstance(val2, float):
                 diff = val1 - val2
-                try:
-                    deviation = (diff / val2) * 100 if val2 != 0 else float('inf')
-                except:
-                    deviation = 0
+                # Float division by a non-zero value cannot raise, so no try/except is needed
+                deviation = (diff / val2) * 100 if val2 != 0 else INF
+                if '"' not in inst and ',' not in inst:
+                    rows.append(row_template % (inst, val1, val2, diff, deviation))
+                    if len(rows) >= CSV_BATCH_ROWS:
+                        csvfile.write("".join(rows))
+                        rows.clear()
+                    continue
+                if rows:
+                    csvfile.write("".join(rows))
+                    rows.clear()
                 writer.writerow([inst, f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", f"{deviation:.2f}%"])
             else:
+                if rows:
+                    csvfile.write("".join(rows))
+                    rows.clear()
                 match = "YES" if str(val1) == str(val2) else "NO"
                 writer.writerow([inst, val1, val2, "N/A", match])
+        csvfile.write("".join(rows))
 
 def get_column_name(file_path, col_index):
     with open(file_path, 'r') as f:
@@ -133,20 +159,40 @@ def get_column_name(file_path, col_index):
                     return f"Column {col_index + 1}"
     return f"Column {col_index + 1}"
 
-def count_lines(path):
-    with open(path, 'rb') as f:
-        count = 0
-        chunk_size = 1024 * 1024
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            count += chunk.count(b'\n')
-    return count
-
 def parse_file_worker(args):
     file_path, inst_col, val_col = args
-    return parse_file_with_mmap(file_path, inst_col, val_col)
+    data, line_count = parse_file_with_mmap(file_path, inst_col, val_col)
+    if shared_memory is None or not data:
+        return data, line_count
+    try:
+        values = array('d', data.values())
+    except TypeError:
+        return data, line_count  # String values do not fit the packed layout; pickle the dict
+    return share_parsed(data, values), line_count
+
+def share_parsed(data, values):
+    # Layout: float64 values, then the names joined by newlines (a split token never holds one)
+    values = values.tobytes()
+    names = b"\n".join(data)
+    shm = shared_memory.SharedMemory(create=True, size=len(values) + len(names))
+    shm.buf[:len(values)] = values
+    shm.buf[len(values):len(values) + len(names)] = names
+    shm.close()
+    return shm.name, len(values), len(names)
+
+def load_parsed(result):
+    if isinstance(result, dict):
+        return result
+    name, values_len, names_len = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = array('d')
+        values.frombytes(shm.buf[:values_len])
+        names = bytes(shm.buf[values_len:values_len + names_len]).split(b"\n")
+    finally:
+        shm.close()
+        shm.unlink()
+    return dict(zip(names, values))
 
 def main():
     parser = argparse.ArgumentParser(description="Compare two files and report missing instances + CSV comparison")
@@ -186,17 +232,19 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    lines1 = count_lines(args.file1)
-    lines2 = count_lines(args.file2)
-
-    with multiprocessing.Pool(2) as pool:
-        results = pool.map(parse_file_worker, [
-            (args.file1, args.instcol1, args.valcol1),
-            (args.file2, args.instcol2, args.valcol2)
-        ])
-
-    data1, instances1 = results[0]
-    data2, instances2 = results[1]
+    # File1 is parsed in a worker while this process parses file2, so only one result is
+    # pickled back; threads would not overlap as the parser is Python code holding the GIL
+    if shared_memory is not None:
+        # Start the tracker before forking so the worker registers its block with this one
+        resource_tracker.ensure_running()
+    with multiprocessing.Pool(1) as pool:
+        result1 = pool.apply_async(parse_file_worker, ((args.file1, args.instcol1, args.valcol1),))
+        data2, lines2 = parse_file_with_mmap(args.file2, args.instcol2, args.valcol2)
+        packed1, lines1 = result1.get()
+    data1 = load_parsed(packed1)
+    # The dicts' keys views stand in for separate instance sets (they are not picklable, so
+    # they are taken here and not in the worker)
+    instances1, instances2 = data1.keys(), data2.keys()
 
     miss2, miss1, matched = compare_instances(data1, data2, instances1, instances2)
 
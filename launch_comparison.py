@@ -90,7 +90,7 @@ def main():
             f"--valcol1 {valcol1} "
             f"--instcol2 '{instcol2_str}' "
             f"--valcol2 {valcol2} "
-            f"--output_prefix 'results/run_{i}'"
+            f"--output_prefix 'results/run_{i}' --lf_rows"
         )
         
         try:
@@ -6,21 +6,21 @@ import sys
 import mmap
 import re
 import csv
+from concurrent.futures import ProcessPoolExecutor
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
+from report_common import advise_sequential, head_lines, is_metadata, require_batch_args
 
-META_RE = re.compile(rb"^(%s)" % b"|".join(k.encode() for k in METADATA_KEYWORDS))
+NUMERIC_RE = re.compile(r"-?\d+\.?\d*")
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 50000  # Rows handed to one writer.writerows() call
+INF = float("inf")
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+PARSE_RANGE_SIZE = 64 * 1024 * 1024  # Bytes of a file handed to each parsing worker
 
 
 def is_valid_data_line(line):
     line = line.strip()
-    if not line or line.startswith(b"#") or META_RE.match(line):
+    if not line or line.startswith(b"#") or is_metadata(line):
         return False
     if line.startswith(b"-") or len(line.split()) >= 2:
         return True
@@ -28,99 +28,183 @@ def is_valid_data_line(line):
 
 
 def find_start_offset(mmapped_file):
+    # One slice split into lines instead of 5000 readline() and tell() calls
     instance_lines = 0
-    mmapped_file.seek(0)
-    for _ in range(5000):
-        pos = mmapped_file.tell()
-        line = mmapped_file.readline()
+    pos = 0
+    for line in head_lines(mmapped_file, 5000):
         if is_valid_data_line(line):
             instance_lines += 1
             if instance_lines >= 25:
                 return pos
+        pos += len(line) + 1
     return 0
 
 
-def extract_value(parts, index):
-    try:
-        return parts[index].decode(errors="ignore")
-    except:
-        return ""
+def normalize_instance(inst):
+    # ASCII names (the norm in these reports) are lower-cased as bytes without decoding; other
+    # names keep the text rules (invalid bytes dropped, Unicode case and whitespace) and are
+    # re-encoded, so both kinds of key compare and sort as the decoded text would
+    if inst.isascii():
+        # split() leaves the \x1c-\x1f separators that str.strip() also removes
+        return inst.strip(b"\x1c\x1d\x1e\x1f").lower()
+    return inst.decode(errors="ignore").strip().lower().encode()
+
+
+def decode_field(raw):
+    return raw.decode(errors="ignore").strip()
+
+
+def is_plain_number(value):
+    # float() reads the value exactly as NUMERIC_RE does only for digits with an optional leading
+    # "-" and inner "."; this rules out ".5" (the regex reads 5), exponents, "1_0" and inf/nan
+    head = value[1:2] if value[:1] == "-" else value[:1]
+    return (head.isdigit() and value[-1:].isdigit()
+            and "_" not in value and "e" not in value and "E" not in value)
 
 
 def extract_numeric(value):
+    # Fast path: a plain decimal value goes straight to float(), skipping the regex
+    if is_plain_number(value):
+        try:
+            return float(value)
+        except ValueError:
+            pass
     try:
-        match = re.search(r"-?\d+\.?\d*", value)
+        match = NUMERIC_RE.search(value)
         return float(match.group()) if match else None
     except:
         return None
 
 
-def parse_file(file_path, inst_col, val_col, starts_with):
+def numeric_value(raw):
+    # A plain ASCII decimal token (the is_plain_number() rules on bytes) goes straight to
+    # float() without decoding; anything else takes the text path
+    head = raw[1:2] if raw[:1] == b"-" else raw[:1]
+    if (head.isdigit() and raw[-1:].isdigit() and 95 not in raw  # b"_"
+            and 101 not in raw and 69 not in raw):  # b"e", b"E"
+        try:
+            return float(raw)
+        except ValueError:
+            pass
+    return extract_numeric(decode_field(raw))
+
+
+def parse_file(file_path, inst_col, val_col, starts_with, start=None, end=None):
+    # Parses the lines that start inside the byte range [start, end); by default everything
+    # from find_start_offset() to the end of the file
+    # Keys and values stay raw bytes tokens; they are decoded only for the output files
     instance_map = {}
+    prefix = starts_with.encode() if starts_with else b""
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        mmapped_file.seek(find_start_offset(mmapped_file))
-
-        for line in iter(mmapped_file.readline, b""):
-            if not is_valid_data_line(line):
-                continue
-            parts = line.strip().split()
-            if len(parts) <= max(inst_col, val_col):
-                continue
+        advise_sequential(mmapped_file)
+        size = mmapped_file.size()
+        if start is None:
+            start = find_start_offset(mmapped_file)
+        # A line straddling `start` belongs to the previous range; the last line starting
+        # before `end` is read through to its newline
+        offset = 0 if start == 0 else (mmapped_file.find(b"\n", start - 1) + 1) or size
+        stop = size if end is None or end >= size else (mmapped_file.find(b"\n", end - 1) + 1) or size
+        tail = b""
+        max_col = max(inst_col, val_col)
+        maxsplit = max_col + 1
+        # Split one large chunk into lines at a time instead of one readline() call per line
+        while offset < stop:
+            lines = (tail + mmapped_file[offset:min(offset + PARSE_CHUNK_SIZE, stop)]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            # Carry the partial last line into the next chunk (keep it on the final one)
+            tail = lines.pop() if offset < stop else b""
+            for line in lines:
+                # One split() per line, no further than the last needed column, serves the
+                # is_valid_data_line() checks and the column lookup; metadata keywords hold no
+                # whitespace, so matching the first token is enough
+                parts = line.split(None, maxsplit)
+                if not parts:
+                    continue
+                first = parts[0]
+                if first.startswith(b"#") or is_metadata(first):
+                    continue
+                if len(parts) < 2 and not first.startswith(b"-"):
+                    continue
+                if len(parts) <= max_col:
+                    continue
+
+                inst = parts[inst_col]
+                if prefix and inst.startswith(prefix):
+                    inst = inst[len(prefix):]
+
+                inst = normalize_instance(inst)
+                if inst:
+                    instance_map[inst] = parts[val_col]
 
-            inst = extract_value(parts, inst_col)
-            val = extract_value(parts, val_col)
+        mmapped_file.close()
+    return instance_map
 
-            if starts_with and inst.startswith(starts_with):
-                inst = inst[len(starts_with):]
 
-            inst = inst.strip().lower()
-            val = val.strip()
+def parse_file_worker(args):
+    return parse_file(*args)
 
-            if inst:
-                instance_map[inst] = val
 
+def split_into_ranges(file_path, inst_col, val_col, starts_with):
+    # The data start is found once here, so every range of the file skips the same header
+    with open(file_path, "rb") as f:
+        mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        first = find_start_offset(mmapped_file)
+        size = mmapped_file.size()
         mmapped_file.close()
+    return [(file_path, inst_col, val_col, starts_with, start, start + PARSE_RANGE_SIZE)
+            for start in range(first, max(size, first + 1), PARSE_RANGE_SIZE)]
+
+
+def merge_parsed_ranges(results):
+    # Ranges arrive in file order, so later duplicates still win as in a single pass
+    instance_map = {}
+    for range_map in results:
+        instance_map.update(range_map)
     return instance_map
 
 
 def compare_instances(inst1, inst2):
-    set1 = set(inst1.keys())
-    set2 = set(inst2.keys())
-    missing_in_file2 = sorted(set1 - set2)
-    missing_in_file1 = sorted(set2 - set1)
-    return missing_in_file2, missing_in_file1
+    # Set algebra on the dict keys views directly, without copying either side into a set first
+    keys1 = inst1.keys()
+    keys2 = inst2.keys()
+    missing_in_file2 = sorted(keys1 - keys2)
+    missing_in_file1 = sorted(keys2 - keys1)
+    matched = sorted(keys1 & keys2)
+    return missing_in_file2, missing_in_file1, matched
 
 
-def write_csv_comparison(file1_data, file2_data, output_path):
-    matched_keys = sorted(set(file1_data.keys()) & set(file2_data.keys()))
-    with open(output_path, "w", newline='') as csvfile:
+def write_csv_comparison(file1_data, file2_data, matched_keys, output_path):
+    with open(output_path, "w", newline='', buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Instance", "Value_File1", "Value_File2", "Difference", "Percent_Deviation"])
 
-        for inst in matched_keys:
-            v1_raw = file1_data[inst]
-            v2_raw = file2_data[inst]
-            v1 = extract_numeric(v1_raw)
-            v2 = extract_numeric(v2_raw)
+        # Rows go to writer.writerows() CSV_BATCH_ROWS at a time instead of one writerow() each
+        batch = []
+        # Both value columns are looked up and parsed by chained map() calls aligned with the
+        # matched keys, so the loop body only does the arithmetic
+        values1 = map(numeric_value, map(file1_data.__getitem__, matched_keys))
+        values2 = map(numeric_value, map(file2_data.__getitem__, matched_keys))
+        for inst, v1, v2 in zip(matched_keys, values1, values2):
             if v1 is not None and v2 is not None:
                 diff = abs(v1 - v2)
-                pct_dev = (diff / v1 * 100) if v1 != 0 else float("inf")
-                writer.writerow([inst, v1, v2, diff, round(pct_dev, 2)])
-
-
-def write_missing_instances(file1_data, file2_data, file1_name, file2_name):
-    keys1 = set(file1_data.keys())
-    keys2 = set(file2_data.keys())
-
-    with open("missing_instances.txt", "w") as out:
+                pct_dev = (diff / v1 * 100) if v1 != 0 else INF
+                batch.append([inst.decode(), v1, v2, diff, round(pct_dev, 2)])
+                if len(batch) >= CSV_BATCH_ROWS:
+                    writer.writerows(batch)
+                    batch.clear()
+        writer.writerows(batch)
+
+
+def write_missing_instances(miss2, miss1, file1_name, file2_name):
+    # One decode and write per section through a large buffer instead of one per instance; a
+    # newline byte never continues a UTF-8 sequence, so decoding the joined names is equivalent
+    with open("missing_instances.txt", "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         out.write(f"{'='*60}\nMissing in {file2_name}:\n{'='*60}\n")
-        for inst in sorted(keys1 - keys2):
-            out.write(inst + "\n")
+        out.write(b"".join(inst + b"\n" for inst in miss2).decode())
 
         out.write(f"\n{'='*60}\nMissing in {file1_name}:\n{'='*60}\n")
-        for inst in sorted(keys2 - keys1):
-            out.write(inst + "\n")
+        out.write(b"".join(inst + b"\n" for inst in miss1).decode())
 
 
 def main():
@@ -133,8 +217,13 @@ def main():
     parser.add_argument("--val_col2", type=int, help="Value column index in file2")
     parser.add_argument("--starts-with1", default="")
     parser.add_argument("--starts-with2", default="")
+    parser.add_argument("--batch", action="store_true",
+                        help="Never prompt; fail if a required argument is missing (for scripted runs)")
     args = parser.parse_args()
 
+    if args.batch:
+        require_batch_args(parser, args, ("file1", "inst_col1", "val_col1", "file2", "inst_col2", "val_col2"))
+
     for arg_name in ["file1", "file2"]:
         if getattr(args, arg_name) is None:
             setattr(args, arg_name, input(f"Enter path to {arg_name}: "))
@@ -142,16 +231,28 @@ def main():
         if getattr(args, arg_name) is None:
             setattr(args, arg_name, int(input(f"Enter {arg_name.replace('_', ' ')}: ")))
 
+    file1_name = os.path.basename(args.file1)
+    file2_name = os.path.basename(args.file2)
+
     print("\n📊 Parsing and comparing...")
     proc = psutil.Process(os.getpid())
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    file1_data = parse_file(args.file1, args.inst_col1, args.val_col1, args.starts_with1)
-    file2_data = parse_file(args.file2, args.inst_col2, args.val_col2, args.starts_with2)
+    # Parse both files in byte ranges spread over every core; threads would not overlap as the
+    # parser is Python code holding the GIL
+    ranges1 = split_into_ranges(args.file1, args.inst_col1, args.val_col1, args.starts_with1)
+    ranges2 = split_into_ranges(args.file2, args.inst_col2, args.val_col2, args.starts_with2)
+    with ProcessPoolExecutor() as executor:
+        results = list(executor.map(parse_file_worker, ranges1 + ranges2))
+
+    file1_data = merge_parsed_ranges(results[:len(ranges1)])
+    file2_data = merge_parsed_ranges(results[len(ranges1):])
 
-    write_missing_instances(file1_data, file2_data, os.path.basename(args.file1), os.path.basename(args.file2))
-    write_csv_comparison(file1_data, file2_data, "instance_comparison.csv")
+    # The key sets are compared once; both writers reuse the results
+    miss2, miss1, matched = compare_instances(file1_data, file2_data)
+    write_missing_instances(miss2, miss1, file1_name, file2_name)
+    write_csv_comparison(file1_data, file2_data, matched, "instance_comparison.csv")
 
     t1 = time.time()
     mem_after = proc.memory_info().rss
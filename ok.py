@@ -4,60 +4,35 @@ import time
 import psutil
 import sys
 import mmap
-import re
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
+from report_common import advise_sequential, head_lines, is_metadata, is_valid_instance_line, require_batch_args
 
-META_RE = re.compile(rb"^(%s)" % b"|".join(k.encode() for k in METADATA_KEYWORDS))
+# Bytes allowed in an instance name; a word made only of these leaves nothing after translate()
+INSTANCE_NAME_BYTES = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_/"
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for missing_instances.txt
 
-# Regex for extracting instance name (pattern-based)
-INSTANCE_RE = re.compile(rb"^\s*([A-Za-z0-9_/]+)")
-
-def is_valid_instance_line(line):
-    line = line.strip()
-    if not line or line.startswith(b"#") or META_RE.match(line):
-        return False
-    return True
-
-def find_start_offset(mmapped_file):
+def find_start_offset(lines):
     instance_lines = 0
-    mmapped_file.seek(0)
-    for _ in range(5000):
-        pos = mmapped_file.tell()
-        line = mmapped_file.readline()
+    pos = 0
+    for line in lines:
         if is_valid_instance_line(line):
             instance_lines += 1
             if instance_lines >= 25:
                 return pos
+        pos += len(line) + 1
     return 0
 
-def detect_instance_column(mmapped_file):
-    mmapped_file.seek(0)
-    candidates = []
-    for _ in range(5000):
-        line = mmapped_file.readline()
-        if is_valid_instance_line(line):
-            parts = line.strip().split()
-            if parts:
-                candidates.append(parts[0].decode(errors='ignore'))
-            if len(candidates) >= 25:
-                break
-    # Check which column most often gives a good instance match
+def detect_instance_column(lines):
+    # Check which column most often gives a good instance match, in a single pass
     col_counter = Counter()
-    mmapped_file.seek(0)
-    for _ in range(5000):
-        line = mmapped_file.readline()
+    for line in lines:
         if is_valid_instance_line(line):
-            parts = line.strip().split()
+            parts = line.split()
             for i, word in enumerate(parts):
-                if re.match(rb"^[A-Za-z0-9_/]+$", word):
+                if not word.translate(None, INSTANCE_NAME_BYTES):
                     col_counter[i] += 1
             if len(col_counter) >= 25:
                 break
@@ -69,20 +44,33 @@ def parse_file_with_mmap(file_path, value_column_index):
     instances = []
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        start_offset = find_start_offset(mmapped_file)
-        mmapped_file.seek(start_offset)
-
-        inst_col = detect_instance_column(mmapped_file)
-        mmapped_file.seek(start_offset)
-
-        for line in iter(mmapped_file.readline, b""):
-            if not is_valid_instance_line(line):
-                continue
-            parts = line.strip().split()
-            if len(parts) <= max(inst_col, value_column_index):
-                continue
-            instance = parts[inst_col].decode(errors='ignore')
-            instances.append(instance)
+        advise_sequential(mmapped_file)
+        # Both header scans walk the same 5000 sample lines, sliced off the mapping once
+        head = head_lines(mmapped_file, 5000)
+        start_offset = find_start_offset(head)
+        inst_col = detect_instance_column(head)
+
+        # Split one large chunk into lines at a time instead of one readline() call per line
+        size = mmapped_file.size()
+        offset, tail = start_offset, b""
+        max_col = max(inst_col, value_column_index)
+        maxsplit = max_col + 1
+        while offset < size:
+            lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            # Carry the partial last line into the next chunk (keep it on the final one)
+            tail = lines.pop() if offset < size else b""
+            for line in lines:
+                # One split() per line, no further than the last needed column, serves the
+                # is_valid_instance_line() checks and the column lookup; metadata keywords hold no
+                # whitespace, so matching the first token is enough
+                parts = line.split(None, maxsplit)
+                if not parts or parts[0].startswith(b"#") or is_metadata(parts[0]):
+                    continue
+                if len(parts) <= max_col:
+                    continue
+                instance = parts[inst_col].decode(errors='ignore')
+                instances.append(instance)
 
         mmapped_file.close()
     return instances
@@ -115,8 +103,13 @@ def main():
     parser.add_argument("--col1", type=int, help="0-based value column index in file1")
     parser.add_argument("--file2", help="Path to second file")
     parser.add_argument("--col2", type=int, help="0-based value column index in file2")
+    parser.add_argument("--batch", action="store_true",
+                        help="Never prompt; fail if a required argument is missing (for scripted runs)")
     args = parser.parse_args()
 
+    if args.batch:
+        require_batch_args(parser, args, ("file1", "col1", "file2", "col2"))
+
     if not args.file1:
         args.file1 = input("Enter path to first file: ")
     if args.col1 is None:
@@ -149,26 +142,23 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    lines1 = count_lines(args.file1)
-    lines2 = count_lines(args.file2)
-
-    list1 = parse_file_with_mmap(args.file1, args.col1)
-    list2 = parse_file_with_mmap(args.file2, args.col2)
+    # A worker process parses file1 while this process counts lines and parses file2
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future1 = executor.submit(parse_file_with_mmap, args.file1, args.col1)
+        lines1 = count_lines(args.file1)
+        lines2 = count_lines(args.file2)
+        list2 = parse_file_with_mmap(args.file2, args.col2)
+        list1 = future1.result()
 
     miss2, miss1 = compare_instances(list1, list2)
 
     out_path = "missing_instances.txt"
-    with open(out_path, "w") as out:
-        out.write(f"{'='*60}\n")
-        out.write(f"Instances missing from {file2_name}:\n")
-        out.write(f"{'='*60}\n")
-        for inst in miss2:
-            out.write(f"{inst}\n")
-        out.write(f"\n{'='*60}\n")
-        out.write(f"Instances missing from {file1_name}:\n")
-        out.write(f"{'='*60}\n")
-        for inst in miss1:
-            out.write(f"{inst}\n")
+    # Each section is joined into one string and written through a large buffer, not one write per instance
+    with open(out_path, "w", buffering=OUTPUT_BUFFER_SIZE) as out:
+        out.write(f"{'='*60}\nInstances missing from {file2_name}:\n{'='*60}\n")
+        out.write("".join(inst + "\n" for inst in miss2))
+        out.write(f"\n{'='*60}\nInstances missing from {file1_name}:\n{'='*60}\n")
+        out.write("".join(inst + "\n" for inst in miss1))
 
     missing_count = len(miss1) + len(miss2)
     t1 = time.time()
@@ -6,11 +6,16 @@ import sys
 import subprocess
 import time
 import mmap
+import zlib
+import shutil
 import re
 import csv
-import multiprocessing
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from report_common import advise_sequential, is_valid_instance_line, key_field
+
 # --- Configuration: Set the default Python path for LSF jobs ---
 # This path will be used in the `bsub` command.
 LSF_PYTHON_EXEC = "/grid/common/pkgs/python/v3.7.2/bin/python3.7"
@@ -23,35 +28,37 @@ LSF_PYTHON_EXEC = "/grid/common/pkgs/python/v3.7.2/bin/python3.7"
 # This regex finds the first integer or float in a string.
 # It handles formats like "3.14", "-.5e-3", "(45.23)", and "123km".
 NUMERIC_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
-METADATA_KEYWORDS_SET = {
-    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
-    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
-    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
-    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
-}
-
-def get_instance_key(line, key_cols):
-    """Extracts the composite key from a line based on specified columns."""
-    parts = line.strip().split()
+# Matches every STATS line a worker prints, so each log is scanned once for all three counters.
+STATS_RE = re.compile(rb"STATS:(missing_in_file1|missing_in_file2|comparison_lines)=(\d+)")
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes of the mmap split into lines per iteration
+SHARD_BUFFER_BUDGET = 256 * 1024 * 1024  # Bytes buffered across all shards, split evenly between them
+MIN_SHARD_BUFFER_SIZE = 64 * 1024  # Floor so a very high shard count still writes in large blocks
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 50000  # Rows handed to one writer.writerows() call
+MERGE_COPY_SIZE = 1024 * 1024  # Block size for streaming shard results into the final files
+
+def get_instance_key(parts, key_cols):
+    """Extracts the composite key from a split line based on specified columns."""
     if not parts or len(parts) <= max(key_cols):
         return None
     try:
-        return "_".join(parts[i] for i in key_cols)
+        # Built from key_field() so every line the worker keys alike lands in the same shard
+        return b"_".join(key_field(parts[i]) for i in key_cols)
     except IndexError:
         return None
 
-def is_valid_instance_line(line_bytes):
-    """Checks if a line is a valid data line, skipping comments and metadata."""
-    line_bytes = line_bytes.strip()
-    if not line_bytes or line_bytes.startswith(b"#"):
-        return False
-    for keyword in METADATA_KEYWORDS_SET:
-        if line_bytes.startswith(keyword):
-            return False
-    return True
-
 def extract_value(value_bytes, comparison_type):
     """Extracts and parses the value based on the chosen comparison type."""
+    if comparison_type == 'numeric':
+        # A plain ASCII decimal token (optional leading "-", no exponent or "_") is read by
+        # float() exactly as NUMERIC_RE would read it, so it skips the decode and the regex
+        head = value_bytes[1:2] if value_bytes[:1] == b"-" else value_bytes[:1]
+        if (head.isdigit() and value_bytes[-1:].isdigit() and 95 not in value_bytes  # b"_"
+                and 101 not in value_bytes and 69 not in value_bytes):  # b"e", b"E"
+            try:
+                return float(value_bytes)
+            except ValueError:
+                pass
     value_str = value_bytes.decode('utf-8', errors='ignore').strip()
     if comparison_type == 'numeric':
         match = NUMERIC_RE.search(value_str)
@@ -69,73 +76,95 @@ def extract_value(value_bytes, comparison_type):
 # SECTION 2: WORKER LOGIC (Code that runs on the LSF cluster)
 # ==============================================================================
 
-def parse_file_worker(args_tuple):
-    """Wrapper function for multiprocessing."""
-    return parse_file_with_mmap(*args_tuple)
-
 def parse_file_with_mmap(file_path, inst_cols, value_col, comparison_type):
     """Efficiently parses a file using memory-mapping."""
-    data, instances_set = {}, set()
+    data = {}
     try:
         with open(file_path, "rb") as f:
             mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-            for line in iter(mmapped_file.readline, b""):
-                if not is_valid_instance_line(line):
-                    continue
-                parts = line.strip().split()
-                if len(parts) <= max(inst_cols + [value_col]):
-                    continue
-                try:
-                    key = tuple(parts[i].decode('utf-8', errors='ignore').strip() for i in inst_cols)
-                    val_parsed = extract_value(parts[value_col], comparison_type)
-                    data[key] = (parts[value_col].decode('utf-8', errors='ignore'), val_parsed)
-                    instances_set.add(key)
-                except IndexError:
-                    continue
+            advise_sequential(mmapped_file)
+            # Split one large chunk into lines at a time instead of one readline() call per line
+            size = mmapped_file.size()
+            offset, tail = 0, b""
+            while offset < size:
+                lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+                offset += PARSE_CHUNK_SIZE
+                # Carry the partial last line into the next chunk (keep it on the final one)
+                tail = lines.pop() if offset < size else b""
+                for line in lines:
+                    # One split per line: the comment and keyword prefixes hold no whitespace,
+                    # so checking the first field is the same as checking the stripped line
+                    parts = line.split()
+                    if not parts or not is_valid_instance_line(parts[0]):
+                        continue
+                    if len(parts) <= max(inst_cols + [value_col]):
+                        continue
+                    try:
+                        # Keys stay bytes through the comparison and are decoded only when written
+                        key = tuple(key_field(parts[i]) for i in inst_cols)
+                        val_parsed = extract_value(parts[value_col], comparison_type)
+                        data[key] = (parts[value_col], val_parsed)
+                    except IndexError:
+                        continue
             mmapped_file.close()
     except FileNotFoundError:
         print(f"Error: Worker could not find file {file_path}. Aborting.")
         sys.exit(1)
-    return data, instances_set
+    return data
 
 def write_missing_file(file1_name, file2_name, miss2, miss1, out_filename):
     """Writes a report of instances missing from either file."""
     with open(out_filename, "w") as out:
         if miss2:
             out.write(f"{'='*60}\nInstances from '{file1_name}' missing in '{file2_name}':\n{'='*60}\n")
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss2)
+            out.write(b"".join(b" | ".join(inst) + b"\n" for inst in miss2).decode())
         if miss1:
             out.write(f"\n{'='*60}\nInstances from '{file2_name}' missing in '{file1_name}':\n{'='*60}\n")
-            out.writelines(f"{' | '.join(inst)}\n" for inst in miss1)
+            out.write(b"".join(b" | ".join(inst) + b"\n" for inst in miss1).decode())
 
-def write_comparison_csv(file1_name, file2_name, data1, data2, matched, out_filename, comparison_type):
+def write_comparison_csv(file1_name, file2_name, data1, data2, out_filename, comparison_type):
     """Writes the detailed comparison results to a CSV file."""
-    if not matched:
+    # Stream the matched keys in file1 order by probing data2, instead of building
+    # and sorting a list of the intersection first
+    matched = (inst for inst in data1 if inst in data2)
+    first = next(matched, None)
+    if first is None:
         return 0
     lines_written = 0
-    with open(out_filename, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        key_len = len(matched[0]) if matched else 1
+    numeric = comparison_type == 'numeric'
+    with open(out_filename, "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as csvfile:
+        # Plain "\n" rows, so merge_results can append the shard bytes unchanged
+        writer = csv.writer(csvfile, lineterminator="\n")
+        key_len = len(first)
         headers = [f"Instance_Key_{i+1}" for i in range(key_len)] + \
                   [f"{file1_name}_Value", f"{file2_name}_Value", "Difference", "Result"]
         writer.writerow(headers)
         
-        for inst in matched:
-            raw1, val1 = data1.get(inst, (None, None))
-            raw2, val2 = data2.get(inst, (None, None))
+        # Rows go to writer.writerows() CSV_BATCH_ROWS at a time instead of one writerow() each
+        batch = []
+        for inst in chain((first,), matched):
+            val1 = data1[inst][1]
+            val2 = data2[inst][1]
+            row = [field.decode() for field in inst]
             
-            if comparison_type == 'numeric' and isinstance(val1, float) and isinstance(val2, float):
+            if numeric and isinstance(val1, float) and isinstance(val2, float):
                 diff = val1 - val2
                 if val2 != 0:
                     deviation = abs((diff / val2) * 100)
                     result = f"{deviation:.2f}%"
                 else:
                     result = "Infinite %" if val1 != 0 else "0.00%"
-                writer.writerow(list(inst) + [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result])
+                row += [f"{val1:.4f}", f"{val2:.4f}", f"{diff:.4f}", result]
             else:
                 match_result = "MATCH" if str(val1) == str(val2) else "MISMATCH"
-                writer.writerow(list(inst) + [str(val1), str(val2), "N/A", match_result])
-            lines_written += 1
+                row += [str(val1), str(val2), "N/A", match_result]
+            batch.append(row)
+            if len(batch) >= CSV_BATCH_ROWS:
+                writer.writerows(batch)
+                lines_written += len(batch)
+                batch.clear()
+        writer.writerows(batch)
+        lines_written += len(batch)
     return lines_written
 
 def run_comparison_worker(args):
@@ -146,24 +175,23 @@ def run_comparison_worker(args):
     instcol1 = list(map(int, args.instcol1.strip().split(",")))
     instcol2 = list(map(int, args.instcol2.strip().split(",")))
 
-    with multiprocessing.Pool(2) as pool:
-        results = pool.map(parse_file_worker, [
-            (args.file1, instcol1, args.valcol1, args.comparison_type),
-            (args.file2, instcol2, args.valcol2, args.comparison_type)
-        ])
+    # A single worker process parses file1 while this process parses file2,
+    # so only one of the two parsed dicts is pickled back across a pipe
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future1 = executor.submit(parse_file_with_mmap, args.file1, instcol1, args.valcol1, args.comparison_type)
+        data2 = parse_file_with_mmap(args.file2, instcol2, args.valcol2, args.comparison_type)
+        data1 = future1.result()
     
-    data1, instances1 = results[0]
-    data2, instances2 = results[1]
-    
-    missing_in_file2 = sorted(list(instances1 - instances2))
-    missing_in_file1 = sorted(list(instances2 - instances1))
-    matched = sorted(list(instances1 & instances2))
+    # Shards are hashed, so the merged reports are never globally sorted; skip sorting here too,
+    # but walk the dicts rather than set differences so the order follows the input files
+    missing_in_file2 = [inst for inst in data1 if inst not in data2]
+    missing_in_file1 = [inst for inst in data2 if inst not in data1]
 
     missing_filename = f"{args.output_prefix}_missing_instances.txt"
     comparison_filename = f"{args.output_prefix}_comparison.csv"
     
     write_missing_file(os.path.basename(args.file1), os.path.basename(args.file2), missing_in_file2, missing_in_file1, missing_filename)
-    comparison_lines = write_comparison_csv(os.path.basename(args.file1), os.path.basename(args.file2), data1, data2, matched, comparison_filename, args.comparison_type)
+    comparison_lines = write_comparison_csv(os.path.basename(args.file1), os.path.basename(args.file2), data1, data2, comparison_filename, args.comparison_type)
     
     t1 = time.time()
     print(f"Worker {args.output_prefix} finished in {t1 - t0:.2f} seconds.")
@@ -211,24 +239,51 @@ def run_sharding(file_path, key_cols_str, num_shards, output_dir):
     print(f"Processing {file_path.name}...")
     line_count = 0
     
-    # Create file handles for all output shard files
-    output_files = [open(output_dir / f"{file_path.name}_shard_{i}.txt", "w") for i in range(num_shards)]
+    # Raw descriptors for all output shard files, each fed from its own large buffer
+    output_fds = [os.open(output_dir / f"{file_path.name}_shard_{i}.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                  for i in range(num_shards)]
+    buffers = [bytearray() for _ in range(num_shards)]
+    shard_buffer_size = max(SHARD_BUFFER_BUDGET // num_shards, MIN_SHARD_BUFFER_SIZE)
     
-    with open(file_path, "r", errors='ignore') as f:
-        for line in f:
-            line_count += 1
-            if not line.strip() or line.strip().startswith("#"):
-                continue
-            
-            key = get_instance_key(line, key_cols)
-            if key is None:
-                continue
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if mmapped_file is not None:
+            advise_sequential(mmapped_file)
+        offset, tail = 0, b""
+        while offset < size:
+            lines = (tail + mmapped_file[offset:offset + PARSE_CHUNK_SIZE]).split(b"\n")
+            offset += PARSE_CHUNK_SIZE
+            # Carry the partial last line into the next chunk; on the final one, drop the
+            # empty piece after a trailing newline so it is not counted as a line
+            tail = lines.pop() if offset < size else b""
+            if lines and not lines[-1] and offset >= size:
+                lines.pop()
+            line_count += len(lines)
+            for line in lines:
+                parts = line.split()
+                if not parts or parts[0].startswith(b"#"):
+                    continue
+                
+                key = get_instance_key(parts, key_cols)
+                if key is None:
+                    continue
 
-            shard_index = hash(key) % num_shards
-            output_files[shard_index].write(line)
+                # crc32 is the same in every process and run, unlike the randomized hash()
+                shard_index = zlib.crc32(key) % num_shards
+                buffer = buffers[shard_index]
+                buffer += line
+                buffer += b"\n"
+                if len(buffer) >= shard_buffer_size:
+                    os.write(output_fds[shard_index], buffer)
+                    buffer.clear()
+        if mmapped_file is not None:
+            mmapped_file.close()
             
-    for file_handle in output_files:
-        file_handle.close()
+    for fd, buffer in zip(output_fds, buffers):
+        if buffer:
+            os.write(fd, buffer)
+        os.close(fd)
         
     print(f"-> Found {line_count} lines and created {num_shards} shards.")
     return line_count
@@ -275,20 +330,31 @@ def submit_and_monitor_jobs(config):
 
     completed_jobs = set()
     while len(completed_jobs) < len(job_ids):
-        for job_id in job_ids:
-            if job_id in completed_jobs:
-                continue
+        pending_ids = [job_id for job_id in job_ids if job_id not in completed_jobs]
 
-            try:
-                # Check job status
-                status_output = subprocess.run(['bjobs', '-o', 'stat', '-noheader', job_id], capture_output=True, text=True)
-                status = status_output.stdout.strip()
-
-                if status in ["DONE", "EXIT"]:
-                    print(f"✅ Job {job_id} completed with status: {status}.")
-                    
-                    # Wait for accounting logs to update
-                    time.sleep(3)
+        try:
+            # Check the status of every pending job with one bjobs call instead of one per job
+            status_output = subprocess.run(['bjobs', '-o', 'jobid stat', '-noheader'] + pending_ids, capture_output=True, text=True)
+            statuses = {}
+            for line in status_output.stdout.splitlines():
+                fields = line.split()
+                if len(fields) >= 2:
+                    statuses[fields[0]] = fields[1]
+        except Exception as e:
+            print(f"Could not check status for jobs {', '.join(pending_ids)}. Assuming they're finished. Error: {e}")
+            completed_jobs.update(pending_ids)
+            continue
+
+        finished_ids = [job_id for job_id in pending_ids if statuses.get(job_id) in ("DONE", "EXIT")]
+        if finished_ids:
+            # Wait once for accounting logs to update, not once per finished job
+            time.sleep(3)
+
+        for job_id in pending_ids:
+            status = statuses.get(job_id, "")
+            if status in ["DONE", "EXIT"]:
+                print(f"✅ Job {job_id} completed with status: {status}.")
+                try:
                     report = subprocess.run(['bacct', '-l', job_id], capture_output=True, text=True).stdout
                     
                     run_time_match = re.search(r"Total Requested Time\s+:\s+([\d.]+) sec", report)
@@ -296,15 +362,13 @@ def submit_and_monitor_jobs(config):
                     
                     print(f"   - Runtime: {run_time_match.group(1) if run_time_match else 'N/A'} seconds")
                     print(f"   - Max Memory: {mem_match.group(1) if mem_match else 'N/A'}")
-                    print("----------------------------------------------------")
-                    
-                    completed_jobs.add(job_id)
-
-                elif not status: # Job is no longer in the active queue
-                    completed_jobs.add(job_id)
+                except Exception as e:
+                    print(f"Could not read accounting for job {job_id}. Error: {e}")
+                print("----------------------------------------------------")
+                
+                completed_jobs.add(job_id)
 
-            except Exception as e:
-                print(f"Could not check status for job {job_id}. Assuming it's finished. Error: {e}")
+            elif not status: # Job is no longer in the active queue
                 completed_jobs.add(job_id)
 
         if len(completed_jobs) < len(job_ids):
@@ -325,28 +389,26 @@ def merge_results(config):
         final_csv_path.touch() # Create an empty file
         return
         
-    with open(final_csv_path, "w") as final_csv:
-        # Write the header from the first file
-        with open(csv_shards[0], "r") as f:
-            header = f.readline()
-            final_csv.write(header)
-        # Write content (including header) from the first file
-        with open(csv_shards[0], "r") as f:
-            f.readline() # Skip header
-            final_csv.write(f.read())
+    # Shards are streamed across in MERGE_COPY_SIZE blocks instead of being read whole
+    with open(final_csv_path, "wb") as final_csv:
+        # Write the header and content from the first file
+        with open(csv_shards[0], "rb") as f:
+            final_csv.write(f.readline())
+            shutil.copyfileobj(f, final_csv, MERGE_COPY_SIZE)
         # Append content from the rest of the files, skipping their headers
         for shard_path in csv_shards[1:]:
-            with open(shard_path, "r") as f:
+            with open(shard_path, "rb") as f:
                 f.readline()  # Skip header
-                final_csv.write(f.read())
+                shutil.copyfileobj(f, final_csv, MERGE_COPY_SIZE)
 
     # Merge missing instances files
     final_missing_path = Path("final_missing_instances.txt")
     missing_shards = sorted(list(Path("results").glob("run_*_missing_instances.txt")))
-    with open(final_missing_path, "w") as final_txt:
+    with open(final_missing_path, "wb") as final_txt:
         for shard_path in missing_shards:
-            final_txt.write(shard_path.read_text())
-            final_txt.write("\n")
+            with open(shard_path, "rb") as f:
+                shutil.copyfileobj(f, final_txt, MERGE_COPY_SIZE)
+            final_txt.write(b"\n")
             
     print("Merging complete!")
 
@@ -355,13 +417,14 @@ def generate_final_summary(config, line_counts, total_runtime):
     print("\n========= FINAL SUMMARY =========")
     print(f"Total execution time: {int(total_runtime // 60)} minutes, {int(total_runtime % 60)} seconds.")
 
-    total_missing1, total_missing2, total_comparison_lines = 0, 0, 0
+    totals = {b"missing_in_file1": 0, b"missing_in_file2": 0, b"comparison_lines": 0}
     
     for log_file in Path("logs").glob("output_*.log"):
-        content = log_file.read_text()
-        total_missing1 += sum(int(val) for val in re.findall(r"STATS:missing_in_file1=(\d+)", content))
-        total_missing2 += sum(int(val) for val in re.findall(r"STATS:missing_in_file2=(\d+)", content))
-        total_comparison_lines += sum(int(val) for val in re.findall(r"STATS:comparison_lines=(\d+)", content))
+        for name, val in STATS_RE.findall(log_file.read_bytes()):
+            totals[name] += int(val)
+    total_missing1 = totals[b"missing_in_file1"]
+    total_missing2 = totals[b"missing_in_file2"]
+    total_comparison_lines = totals[b"comparison_lines"]
 
     print("\n--- Data Statistics ---")
     print(f"Lines in '{config['file1'].name}': {line_counts['file1']}")
@@ -0,0 +1,67 @@
+# File: report_common.py
+# Purpose: Helpers shared by the comparison scripts and the LSF launchers that shard their input.
+import mmap
+
+METADATA_KEYWORDS = (
+    b"VERSION", b"CREATION", b"CREATOR", b"PROGRAM", b"DIVIDERCHAR", b"DESIGN",
+    b"UNITS", b"INSTANCE_COUNT", b"NOMINAL_VOLTAGE", b"POWER_NET", b"GROUND_NET",
+    b"WINDOW", b"RP_VALUE", b"RP_FORMAT", b"RP_INST_LIMIT", b"RP_THRESHOLD",
+    b"RP_PIN_NAME", b"MICRON_UNITS", b"INST_NAME"
+)
+# Keywords grouped by first byte: a data line's first byte matches no group, so it costs one
+# dict lookup instead of a startswith() over every keyword
+METADATA_KEYWORDS_BY_FIRST_BYTE = {
+    first: tuple(k for k in METADATA_KEYWORDS if k[0] == first)
+    for first in {k[0] for k in METADATA_KEYWORDS}
+}
+
+FIELD_SEPARATORS = (b"\x1c", b"\x1d", b"\x1e", b"\x1f")  # Stripped by str.strip() but not split on
+HEAD_SCAN_SIZE = 256 * 1024  # Bytes sliced off the mmap to sample the header lines
+
+def key_field(field_bytes):
+    """Returns an instance key field as bytes, matching the decoded and stripped text.
+
+    Sharders and comparers both key on this, so lines that compare equal always land in the
+    same shard.
+    """
+    # ASCII fields (the norm in these reports) skip decoding
+    if field_bytes.isascii():
+        return field_bytes.strip(b"\x1c\x1d\x1e\x1f")
+    return field_bytes.decode('utf-8', errors='ignore').strip().encode()
+
+def has_plain_keys(buf):
+    """Checks that every token in buf is already its own key_field(), so keys need no normalising."""
+    return buf.isascii() and not any(sep in buf for sep in FIELD_SEPARATORS)
+
+def is_metadata(token):
+    """Checks whether a stripped, non-empty line (or its first token) starts with a header keyword."""
+    candidates = METADATA_KEYWORDS_BY_FIRST_BYTE.get(token[0])
+    return candidates is not None and token.startswith(candidates)
+
+def is_valid_instance_line(line):
+    """Checks that a line is not blank, a comment or a header line."""
+    line = line.strip()
+    return bool(line) and not line.startswith(b"#") and not is_metadata(line)
+
+def head_lines(mmapped_file, count):
+    """Returns the first count lines from one slice of the mapping, widened only when they do not fit."""
+    size = HEAD_SCAN_SIZE
+    while True:
+        lines = mmapped_file[:size].split(b"\n", count)
+        if len(lines) > count or size >= len(mmapped_file):
+            return lines[:count]
+        size *= 4
+
+def advise_sequential(mmapped_file):
+    """Asks the kernel for aggressive readahead on a mapping read front to back once."""
+    # mmap.madvise() is Python 3.8+; older interpreters just go without the hint
+    if hasattr(mmapped_file, "madvise"):
+        mmapped_file.madvise(mmap.MADV_SEQUENTIAL)
+        mmapped_file.madvise(mmap.MADV_WILLNEED)
+
+def require_batch_args(parser, args, names):
+    """Exits through parser.error() if any named argument is unset or empty, as --batch never prompts."""
+    # Not a plain truth test: column 0 is a valid index
+    missing = [name for name in names if getattr(args, name) in (None, "")]
+    if missing:
+        parser.error("--batch needs " + ", ".join("--" + name for name in missing))
@@ -4,50 +4,48 @@ import time
 import psutil
 import sys
 import mmap
-import re
 import csv
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
+from report_common import advise_sequential, head_lines, is_metadata
 
-META_RE = re.compile(rb"^(%s)" % b"|".join(k.encode() for k in METADATA_KEYWORDS))
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 50000  # Rows handed to one writer.writerows() call
 
 def is_valid_instance_line(line):
     line = line.strip()
-    if not line or line.startswith(b"#") or META_RE.match(line):
+    if not line or line.startswith(b"#") or is_metadata(line):
         return False
     return line.startswith(b"-")
 
 def find_start_offset(mmapped_file):
+    # One slice split into lines instead of 1000 readline() and tell() calls
     instance_lines = 0
-    mmapped_file.seek(0)
-    for _ in range(1000):
-        pos = mmapped_file.tell()
-        line = mmapped_file.readline()
+    pos = 0
+    for line in head_lines(mmapped_file, 1000):
         if is_valid_instance_line(line):
             instance_lines += 1
             if instance_lines >= 25:
                 return pos
+        pos += len(line) + 1
     return 0
 
 def parse_file_with_mmap_to_dict(file_path, inst_col, data_col):
     result = {}
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        advise_sequential(mmapped_file)
         start_offset = find_start_offset(mmapped_file)
         mmapped_file.seek(start_offset)
+        max_col = max(inst_col, data_col)
+        maxsplit = max_col + 1
 
         for line in iter(mmapped_file.readline, b""):
             if not is_valid_instance_line(line):
                 continue
-            parts = line.strip().split()
-            if len(parts) <= max(inst_col, data_col):
+            # No strip() first: split() skips surrounding whitespace and stops after the last needed column
+            parts = line.split(None, maxsplit)
+            if len(parts) <= max_col:
                 continue
             inst = parts[inst_col]
             data = parts[data_col]
@@ -91,35 +89,44 @@ def main():
     lines1 = count_lines(args.file1)
     lines2 = count_lines(args.file2)
 
-    with ThreadPoolExecutor() as executor:
+    # Two threads would parse one after the other, as the parser is Python code holding the GIL;
+    # a worker process takes file1 instead while this process parses file2
+    with ProcessPoolExecutor(max_workers=1) as executor:
         f1 = executor.submit(parse_file_with_mmap_to_dict, args.file1, args.inst_col1, args.data_col1)
-        f2 = executor.submit(parse_file_with_mmap_to_dict, args.file2, args.inst_col2, args.data_col2)
+        dict2 = parse_file_with_mmap_to_dict(args.file2, args.inst_col2, args.data_col2)
         dict1 = f1.result()
-        dict2 = f2.result()
 
     # Comparison and CSV Output
-    matched_instances = sorted(set(dict1.keys()) & set(dict2.keys()))
+    # Keys views support set operators, so neither dict is copied into a set
+    matched_instances = sorted(dict1.keys() & dict2.keys())
     csv_path = "matched_instance_comparison.csv"
-    with open(csv_path, "w", newline="") as csvfile:
+    with open(csv_path, "w", newline="", buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Instance", f"{file1_name} Value", f"{file2_name} Value", "Difference", "% Deviation"])
+        # Rows go to writer.writerows() CSV_BATCH_ROWS at a time instead of one writerow() each
+        batch = []
         for inst in matched_instances:
             v1 = dict1[inst]
             v2 = dict2[inst]
             diff = v1 - v2
             deviation = (diff / v2 * 100) if v2 != 0 else float('inf')
-            writer.writerow([inst, v1, v2, diff, round(deviation, 2)])
+            batch.append([inst, v1, v2, diff, round(deviation, 2)])
+            if len(batch) >= CSV_BATCH_ROWS:
+                writer.writerows(batch)
+                batch.clear()
+        writer.writerows(batch)
 
     # Missing instance report
-    miss2 = sorted(set(dict1.keys()) - set(dict2.keys()))
-    miss1 = sorted(set(dict2.keys()) - set(dict1.keys()))
+    miss2 = sorted(dict1.keys() - dict2.keys())
+    miss1 = sorted(dict2.keys() - dict1.keys())
 
     out_path = "missing_instances.txt"
-    with open(out_path, "w") as out:
+    # One joined write per section through a large buffer instead of one buffered write per instance
+    with open(out_path, "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         out.write(f"{'='*60}\nInstances missing from {file2_name}:\n{'='*60}\n")
-        out.writelines([f"{inst}\n" for inst in miss2])
+        out.write("".join(inst + "\n" for inst in miss2))
         out.write(f"\n{'='*60}\nInstances missing from {file1_name}:\n{'='*60}\n")
-        out.writelines([f"{inst}\n" for inst in miss1])
+        out.write("".join(inst + "\n" for inst in miss1))
 
     t1 = time.time()
     mem_after = proc.memory_info().rss
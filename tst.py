@@ -4,44 +4,44 @@ import time
 import psutil
 import sys
 import mmap
-import re
 import csv
+from concurrent.futures import ProcessPoolExecutor
 
-# Metadata keywords to skip
-METADATA_KEYWORDS = {
-    "VERSION", "CREATION", "CREATOR", "PROGRAM", "DIVIDERCHAR", "DESIGN",
-    "UNITS", "INSTANCE_COUNT", "NOMINAL_VOLTAGE", "POWER_NET", "GROUND_NET",
-    "WINDOW", "RP_VALUE", "RP_FORMAT", "RP_INST_LIMIT", "RP_THRESHOLD",
-    "RP_PIN_NAME", "MICRON_UNITS", "INST_NAME"
-}
-META_RE = re.compile(rb"^(%s)" % b"|".join(k.encode() for k in METADATA_KEYWORDS))
+from report_common import advise_sequential, head_lines, is_metadata, require_batch_args
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # Write buffer for the output files
+CSV_BATCH_ROWS = 50000  # Rows handed to one writer.writerows() call
 
 def is_valid_instance_line(line):
     line = line.strip()
-    if not line or line.startswith(b"#") or META_RE.match(line):
+    if not line or line.startswith(b"#") or is_metadata(line):
         return False
     return line.startswith(b"-")
 
 def find_start_offset(mmapped_file):
-    mmapped_file.seek(0)
-    for _ in range(5000):
-        pos = mmapped_file.tell()
-        line = mmapped_file.readline()
+    # One slice split into lines instead of 5000 readline() and tell() calls
+    pos = 0
+    for line in head_lines(mmapped_file, 5000):
         if is_valid_instance_line(line):
             return pos
+        pos += len(line) + 1
     return 0
 
 def parse_file_for_instances(file_path, inst_col, value_col, starts_with):
     instance_map = {}
     with open(file_path, "rb") as f:
         mmapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        advise_sequential(mmapped_file)
         mmapped_file.seek(find_start_offset(mmapped_file))
+        max_col = max(inst_col, value_col)
+        maxsplit = max_col + 1
 
         for line in iter(mmapped_file.readline, b""):
             if not is_valid_instance_line(line):
                 continue
-            parts = line.strip().split()
-            if len(parts) <= max(inst_col, value_col):
+            # split() skips the surrounding whitespace itself and stops after the last needed column
+            parts = line.split(None, maxsplit)
+            if len(parts) <= max_col:
                 continue
             inst = parts[inst_col]
             val = parts[value_col]
@@ -57,25 +57,33 @@ def parse_file_for_instances(file_path, inst_col, value_col, starts_with):
     return instance_map
 
 def compare_instances(inst1, inst2):
-    set1 = set(inst1.keys())
-    set2 = set(inst2.keys())
-    missing_in_file2 = sorted(set1 - set2)
-    missing_in_file1 = sorted(set2 - set1)
-    return missing_in_file2, missing_in_file1
-
-def write_csv_comparison(file1_data, file2_data, output_path):
-    with open(output_path, "w", newline='') as csvfile:
+    # Set algebra on the dict keys views directly, without copying either side into a set first
+    keys1 = inst1.keys()
+    keys2 = inst2.keys()
+    missing_in_file2 = sorted(keys1 - keys2)
+    missing_in_file1 = sorted(keys2 - keys1)
+    matched = sorted(keys1 & keys2)
+    return missing_in_file2, missing_in_file1, matched
+
+def write_csv_comparison(file1_data, file2_data, matched, output_path):
+    with open(output_path, "w", newline='', buffering=OUTPUT_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Instance", "Value_File1", "Value_File2", "Difference", "Percent_Deviation"])
-        for inst in sorted(set(file1_data) & set(file2_data)):
+        # Rows go to writer.writerows() CSV_BATCH_ROWS at a time instead of one writerow() each
+        batch = []
+        for inst in matched:
             try:
                 v1 = float(file1_data[inst])
                 v2 = float(file2_data[inst])
                 diff = abs(v1 - v2)
                 pct_dev = (diff / v1 * 100) if v1 != 0 else float("inf")
-                writer.writerow([inst, v1, v2, diff, round(pct_dev, 2)])
+                batch.append([inst, v1, v2, diff, round(pct_dev, 2)])
             except ValueError:
                 continue  # Skip if values are not float-compatible
+            if len(batch) >= CSV_BATCH_ROWS:
+                writer.writerows(batch)
+                batch.clear()
+        writer.writerows(batch)
 
 def count_lines(path):
     with open(path, 'rb') as f:
@@ -102,8 +110,13 @@ def main():
     parser.add_argument("--val_col2", type=int, help="Value column index in file2")
     parser.add_argument("--starts-with1", default=None)
     parser.add_argument("--starts-with2", default=None)
+    parser.add_argument("--batch", action="store_true",
+                        help="Never prompt; fail if a required argument is missing (for scripted runs)")
     args = parser.parse_args()
 
+    if args.batch:
+        require_batch_args(parser, args, ("file1", "inst_col1", "val_col1", "file2", "inst_col2", "val_col2"))
+
     if not args.file1:
         args.file1 = input("Enter path to first file: ")
     if args.inst_col1 is None:
@@ -125,22 +138,24 @@ def main():
     mem_before = proc.memory_info().rss
     t0 = time.time()
 
-    file1_data = parse_file_for_instances(args.file1, args.inst_col1, args.val_col1, args.starts_with1)
-    file2_data = parse_file_for_instances(args.file2, args.inst_col2, args.val_col2, args.starts_with2)
+    # A worker process parses file1 while this one parses file2; only file1's dict is pickled back
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future1 = executor.submit(parse_file_for_instances, args.file1, args.inst_col1, args.val_col1, args.starts_with1)
+        file2_data = parse_file_for_instances(args.file2, args.inst_col2, args.val_col2, args.starts_with2)
+        file1_data = future1.result()
 
-    miss2, miss1 = compare_instances(file1_data, file2_data)
+    # The key sets are compared once; both writers reuse the results
+    miss2, miss1, matched = compare_instances(file1_data, file2_data)
 
     # Write missing instances
-    with open("missing_instances.txt", "w") as out:
+    with open("missing_instances.txt", "w", buffering=OUTPUT_BUFFER_SIZE) as out:
         out.write(f"{'='*60}\nMissing in {file2_name}:\n{'='*60}\n")
-        for m in miss2:
-            out.write(m + "\n")
+        out.write("".join(m + "\n" for m in miss2))
         out.write(f"\n{'='*60}\nMissing in {file1_name}:\n{'='*60}\n")
-        for m in miss1:
-            out.write(m + "\n")
+        out.write("".join(m + "\n" for m in miss1))
 
     # Write CSV comparison
-    write_csv_comparison(file1_data, file2_data, "instance_comparison.csv")
+    write_csv_comparison(file1_data, file2_data, matched, "instance_comparison.csv")
 
     t1 = time.time()
     mem_after = proc.memory_info().rss